@@ -0,0 +1,191 @@
+"""
+Minimal local stand-ins for the blueshift pipeline API, so that the 
+pipeline examples in `piplines/custom.py` can be imported and their 
+`compute` methods called directly on synthetic data, offline. The
+strategy API is stubbed with no-ops, to import strategy modules.
+"""
+import os
+import sys
+import types
+import importlib.util
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class _Term():
+    inputs = ()
+    window_length = None
+    mask = None
+    
+    def __init__(self, *args, window_length=None, mask=None, **kwargs):
+        if window_length is not None:
+            self.window_length = window_length
+        self.mask = mask
+        self.params = kwargs
+
+class CustomFactor(_Term):
+    def __gt__(self, value):
+        return _Derived(self, lambda x:x > value)
+    
+    def top(self, size):
+        def top(x):
+            ranks = np.argsort(np.argsort(-np.nan_to_num(x, nan=-np.inf)))
+            return ranks < size
+        return _Derived(self, top)
+
+class CustomFilter(_Term):
+    pass
+
+class _Derived(CustomFilter):
+    """ a filter computed from the output of a factor. """
+    def __init__(self, factor, fn):
+        super().__init__(window_length=factor.window_length)
+        self.inputs = factor.inputs
+        self.factor = factor
+        self.fn = fn
+    
+    def compute(self, today, assets, out, *inputs):
+        values = np.empty(len(out))
+        self.factor.compute(today, assets, values, *inputs)
+        out[:] = self.fn(values)
+
+class EquityPricing():
+    close = 'close'
+    volume = 'volume'
+    open = 'open'
+    high = 'high'
+    low = 'low'
+
+class AverageDollarVolume(CustomFactor):
+    """ the built-in average dollar volume factor. """
+    inputs = [EquityPricing.close, EquityPricing.volume]
+    
+    def compute(self, today, assets, out, close, volume):
+        out[:] = np.nansum(close * volume, axis=0)/len(close)
+
+class Asset():
+    """ an asset identified by its sid. """
+    def __init__(self, sid):
+        self.sid = int(sid)
+        self.symbol = self.exchange_ticker = f'SYM{self.sid}'
+
+class _Algo():
+    def sid(self, sid):
+        return Asset(sid)
+    
+    def symbol(self, symbol):
+        return Asset(symbol[3:])
+
+class Context():
+    """ an algo context, for the filters requiring one. """
+    def get_algo(self):
+        return _Algo()
+
+def install():
+    """ install the stand-ins if blueshift is not available. """
+    try:
+        import blueshift.pipeline
+        return False
+    except ImportError:
+        pass
+    
+    modules = {}
+    for name in ['blueshift', 'blueshift.data', 'blueshift.data.pipeline', 
+                 'blueshift.data.pipeline.data', 'blueshift.pipeline', 
+                 'blueshift.pipeline.factors']:
+        modules[name] = types.ModuleType(name)
+    
+    modules['blueshift.data.pipeline.data'].EquityPricing = EquityPricing
+    modules['blueshift.pipeline'].CustomFactor = CustomFactor
+    modules['blueshift.pipeline'].CustomFilter = CustomFilter
+    modules['blueshift.pipeline.factors'].AverageDollarVolume = AverageDollarVolume
+    sys.modules.update(modules)
+    return True
+
+def load_custom():
+    """ import `piplines/custom.py` as a module. """
+    install()
+    path = os.path.join(ROOT, 'piplines', 'custom.py')
+    spec = importlib.util.spec_from_file_location('custom', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_cache():
+    """ import `piplines/cache.py` as a module. """
+    install_api()
+    path = os.path.join(ROOT, 'piplines', 'cache.py')
+    spec = importlib.util.spec_from_file_location('cache', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class _NoOp():
+    """ a no-op function, whose attributes are no-ops too. """
+    def __call__(self, *args, **kwargs):
+        return None
+    
+    def __getattr__(self, name):
+        return self
+
+_noop = _NoOp()
+
+def install_api():
+    """ install no-op `blueshift.api` and `blueshift.finance` modules if
+        blueshift is not available. """
+    try:
+        import blueshift.api
+        return False
+    except ImportError:
+        pass
+
+    modules = {}
+    for name in ['blueshift', 'blueshift.api', 'blueshift.finance']:
+        modules[name] = sys.modules.get(name) or types.ModuleType(name)
+    # any API function or object resolves to a no-op
+    modules['blueshift.api'].__getattr__ = lambda name:_noop
+    modules['blueshift.finance'].__getattr__ = lambda name:_noop
+    sys.modules.update(modules)
+    return True
+
+class Strategy():
+    """ a sub-strategy base class. """
+    def __init__(self, name, initial_capital):
+        self.name = name
+        self.initial_capital = initial_capital
+
+def install_library():
+    """ install `blueshift.protocol` and the technical indicators of 
+        `blueshift.library` (with talib) if blueshift is not available. """
+    try:
+        import blueshift.protocol
+        return False
+    except ImportError:
+        pass
+    
+    import talib as ta
+    install_api()
+    modules = {}
+    for name in ['blueshift.protocol', 'blueshift.library', 
+                 'blueshift.library.technicals',
+                 'blueshift.library.technicals.indicators']:
+        modules[name] = sys.modules.get(name) or types.ModuleType(name)
+    
+    indicators = modules['blueshift.library.technicals.indicators']
+    indicators.bbands = lambda px, lookback=20:tuple(
+            x[-1] for x in ta.BBANDS(px, lookback))
+    indicators.ema = lambda px, lookback=20:ta.EMA(px, lookback)[-1]
+    indicators.rsi = lambda px, lookback=14:ta.RSI(px, lookback)[-1]
+    modules['blueshift.protocol'].Strategy = Strategy
+    sys.modules.update(modules)
+    return True
+
+def load_strategy(path):
+    """ import a strategy module, relative to the repository root. """
+    install_api()
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
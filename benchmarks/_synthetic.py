@@ -0,0 +1,69 @@
+"""
+Synthetic price/volume panels and reference (per-asset) indicators for
+the benchmarks.
+"""
+import numpy as np
+import pandas as pd
+import talib as ta
+
+try:
+    from scipy.stats import skew
+except ImportError:
+    skew = None
+
+def make_prices(window, assets, nan_fraction=0.0, seed=42):
+    """ random-walk close prices, with leading NaNs in some columns. """
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, 0.02, size=(window, assets))
+    px = 100*np.exp(np.cumsum(returns, axis=0))
+    if nan_fraction > 0:
+        n = int(assets*nan_fraction)
+        cols = rng.choice(assets, n, replace=False)
+        px[:rng.integers(1, max(2, window//2)), cols] = np.nan
+    return px
+
+def make_volumes(window, assets, nan_fraction=0.0, seed=43):
+    """ log-normal volumes, with random missing bars. """
+    rng = np.random.default_rng(seed)
+    volume = np.exp(rng.normal(12, 2, size=(window, assets)))
+    if nan_fraction > 0:
+        volume[rng.random((window, assets)) < nan_fraction] = np.nan
+    return volume
+
+# reference indicators, of the form f(px, n) returning the last value, as 
+# in the technicals library (TA-Lib for the moving averages, RSI and ROC, 
+# scipy for the skewness). They are not picked up by `technical_factor` by 
+# name, see `register_kernels`.
+
+def sma(px, lookback):
+    return ta.SMA(px, timeperiod=lookback)[-1]
+
+def rsi(px, lookback=14):
+    return ta.RSI(px, timeperiod=lookback)[-1]
+
+def ema(px, lookback):
+    return ta.EMA(px, timeperiod=lookback)[-1]
+
+def roc(px, lookback):
+    return ta.ROC(px, timeperiod=lookback)[-1]
+
+def volatility(px, lookback=1):
+    return pd.Series(px).pct_change(lookback).std(ddof=0)
+
+def skewness(px, lookback=None):
+    return skew(px)
+
+def register_kernels(custom):
+    """ register the batched (and multi-lookback) kernels of `custom` for 
+        the references. """
+    custom.register_batch_kernel(sma, custom.batch_sma)
+    custom.register_batch_kernel(rsi, custom.batch_rsi)
+    custom.register_batch_kernel(ema, custom.batch_ema)
+    custom.register_batch_kernel(roc, custom.batch_roc)
+    custom.register_multi_kernel(sma, custom.multi_sma)
+    custom.register_multi_kernel(rsi, custom.multi_rsi)
+    custom.register_multi_kernel(ema, custom.multi_ema)
+    custom.register_multi_kernel(roc, custom.multi_roc)
+    custom.register_batch_kernel(volatility, custom.batch_volatility)
+    if skew is not None:
+        custom.register_batch_kernel(skewness, custom.batch_skew)
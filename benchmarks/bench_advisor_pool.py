@@ -0,0 +1,104 @@
+"""
+Benchmark the ensemble agent in `portfolio/no_regret_portfolio.py` with
+the advisors evaluated serially and in an `AdvisorPool` of worker
+processes, against the number of advisors and workers. The advisors are
+pattern scanners (correlation of the latest bars with all past windows),
+with a different pattern length each, so that no work is shared.
+
+    python benchmarks/bench_advisor_pool.py --advisors 10 50 --workers 2 4
+
+The pool results are checked to be identical to the serial ones.
+"""
+import os
+import time
+import argparse
+import functools
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from _standins import load_strategy
+
+def pattern_expert(px, params, length):
+    """ sign of the average move following the past windows most
+        correlated with the latest one. """
+    close = px.close.values
+    returns = close[1:]/close[:-1] - 1
+    windows = sliding_window_view(returns[:-1], length)
+    pattern = returns[-length:]
+    windows = windows - windows.mean(axis=1, keepdims=True)
+    pattern = pattern - pattern.mean()
+    corr = windows @ pattern/(np.linalg.norm(windows, axis=1)*np.linalg.norm(pattern))
+    following = returns[length:]
+    best = np.argsort(corr)[-10:]
+    return np.sign(following[best].mean())
+
+class History():
+    """ data.history stand-in over synthetic OHLC prices. """
+    def __init__(self, assets, bars, seed=7):
+        rng = np.random.default_rng(seed)
+        index = pd.date_range('2024-01-01 09:15', periods=bars, freq='min')
+        self.frames = {}
+        for asset in assets:
+            close = 100*np.exp(np.cumsum(rng.normal(0, 1e-3, bars)))
+            open_ = close*(1 + rng.normal(0, 3e-4, bars))
+            self.frames[asset] = pd.DataFrame(
+                    {'open':open_, 'high':np.maximum(open_, close)*1.0005,
+                     'low':np.minimum(open_, close)*0.9995, 'close':close},
+                    index=index)
+        self.end = 0
+
+    def history(self, assets, fields, nbars, freq):
+        return pd.concat(dict((asset, self.frames[asset].iloc[self.end-nbars:self.end]) \
+                              for asset in assets))
+
+class Context():
+    pass
+
+def run(module, n_advisors, workers, args):
+    context = Context()
+    context.universe = [f'A{i}' for i in range(args.assets)]
+    context.params = {'indicator_lookback':args.bars, 'indicator_freq':'1m',
+                      'buy_signal_threshold':0.5, 'sell_signal_threshold':-0.5,
+                      'leverage':1}
+    data = History(context.universe, args.bars + args.steps)
+    advisors = [module.Advisor(f'pattern_{i}',
+                               functools.partial(pattern_expert, length=5+i),
+                               context.universe) for i in range(n_advisors)]
+    weights, timings = [], []
+    with module.Agent(advisors, workers=workers) as agent:
+        for step in range(args.steps):
+            data.end = args.bars + step + 1
+            start = time.perf_counter()
+            agent.compute_weights(context, data)
+            timings.append(time.perf_counter() - start)
+            weights.append([context.weights[asset] for asset in context.universe])
+
+    # the first bar includes the pool warm-up
+    return np.median(timings[1:]), np.array(weights), [a.perf for a in advisors]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--advisors', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({2, os.cpu_count() or 1}))
+    parser.add_argument('--assets', type=int, default=20)
+    parser.add_argument('--bars', type=int, default=375)
+    parser.add_argument('--steps', type=int, default=6)
+    args = parser.parse_args()
+
+    module = load_strategy('portfolio/no_regret_portfolio.py')
+    print(f'{os.cpu_count()} cores, {args.assets} assets, {args.bars} bars')
+    print(f'{"advisors":>8}{"workers":>9}{"ms/bar":>10}{"speed-up":>10}{"identical":>11}')
+    for n_advisors in args.advisors:
+        serial, weights, perfs = run(module, n_advisors, None, args)
+        print(f'{n_advisors:>8}{"serial":>9}{1000*serial:>10.2f}{1.0:>9.2f}x{"":>11}')
+        for workers in args.workers:
+            elapsed, pool_weights, pool_perfs = run(module, n_advisors, workers, args)
+            identical = np.array_equal(weights, pool_weights) and perfs == pool_perfs
+            print(f'{n_advisors:>8}{workers:>9}{1000*elapsed:>10.2f}'
+                  f'{serial/elapsed:>9.2f}x{str(identical):>11}')
+
+if __name__ == '__main__':
+    main()
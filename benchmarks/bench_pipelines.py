@@ -0,0 +1,179 @@
+"""
+Benchmark the pipeline factors and filters in `piplines/custom.py` on
+synthetic close/volume panels, by calling their `compute` methods
+directly over a number of consecutive days.
+
+    python benchmarks/bench_pipelines.py --assets 100 1000 --bars 20 252 \\
+        --output results.json
+    python benchmarks/bench_pipelines.py --compare results.json
+
+Reports the wall time per call, the peak traced memory of a call and the
+net number of memory blocks allocated by it (from `tracemalloc`). With
+`--output` the results are saved as JSON, and `--compare` checks a run
+against saved results and exits with an error on regressions.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import warnings
+import tracemalloc
+
+import numpy as np
+
+from _standins import load_custom, Asset, Context
+from _synthetic import make_prices, make_volumes, register_kernels, rsi, ema, roc
+
+def _universe(assets):
+    return [Asset(sid) for sid in range(0, assets, 3)]
+
+CASES = {
+    'select_universe':
+        lambda c, bars, n:c.select_universe(bars, 100),
+    'average_volume_filter':
+        lambda c, bars, n:c.average_volume_filter(bars, 1E8),
+    'average_volume_filter_incremental':
+        lambda c, bars, n:c.average_volume_filter(bars, 1E8, incremental=True),
+    'average_volume_factor':
+        lambda c, bars, n:c.average_volume_factor(bars, 1E8),
+    'returns_factor':
+        lambda c, bars, n:c.returns_factor(bars, min(5, bars-1)),
+    'filtered_returns_factor':
+        lambda c, bars, n:c.filtered_returns_factor(
+                bars, c.average_volume_filter(bars, 1E8)),
+    'technical_factor_rsi':
+        lambda c, bars, n:c.technical_factor(bars, rsi, min(14, bars-1)),
+    'technical_factor_ema':
+        lambda c, bars, n:c.technical_factor(bars, ema, min(20, bars)),
+    'technical_factor_roc':
+        lambda c, bars, n:c.technical_factor(bars, roc, min(20, bars-1)),
+    'multi_lookback_factor_ema':
+        lambda c, bars, n:c.multi_lookback_factor(
+                bars, ema, sorted({min(k, bars) for k in (5, 10, 20, 50)})),
+    'fused_factor':
+        lambda c, bars, n:c.fused_factor(bars, ['returns', 'volatility']),
+    'filter_universe':
+        lambda c, bars, n:c.filter_universe(_universe(n), context=Context()),
+    'exclude_assets':
+        lambda c, bars, n:c.exclude_assets(_universe(n), context=Context()),
+    'filter_assets':
+        lambda c, bars, n:c.filter_assets(
+                lambda asset:asset.sid % 2 == 0, context=Context()),
+}
+
+def _output(term, assets):
+    outputs = getattr(type(term), 'outputs', None)
+    if outputs and not isinstance(outputs, property):
+        return np.recarray(assets, dtype=[(name, np.float64) for name in outputs])
+
+    mro = [cls.__name__ for cls in type(term).__mro__]
+    dtype = np.bool_ if 'CustomFilter' in mro else np.float64
+    return np.empty(assets, dtype=dtype)
+
+def run_case(custom, case, assets, bars, nan_fraction, days):
+    total = bars + days
+    close = make_prices(total, assets, nan_fraction)
+    volume = make_volumes(total, assets, nan_fraction)
+    panels = {'close':close, 'volume':volume}
+
+    term = CASES[case](custom, bars, assets)
+    inputs = [getattr(col, 'name', col) for col in term.inputs]
+    sids = np.arange(assets, dtype=np.int64)
+    dates = np.datetime64('2020-01-01') + np.arange(total)
+    out = _output(term, assets)
+
+    def call(day):
+        window = [panels[name][day-bars:day] for name in inputs]
+        term.compute(dates[day], sids, out, *window)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        # all days but the last timed, the last one traced
+        timings = []
+        for day in range(bars, total-1):
+            start = time.perf_counter()
+            call(day)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        call(total-1)
+        _, peak = tracemalloc.get_traced_memory()
+        net_blocks = sys.getallocatedblocks() - blocks
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {'case':case, 'assets':assets, 'bars':bars,
+            'nan_fraction':nan_fraction, 'calls':len(timings),
+            'mean_ms':1000*timings.mean(), 'min_ms':1000*timings.min(),
+            'peak_kib':(peak - base)/1024, 'net_blocks':net_blocks}
+
+def _key(result):
+    return (result['case'], result['assets'], result['bars'],
+            result['nan_fraction'])
+
+def compare(results, path, threshold):
+    with open(path) as fp:
+        baseline = {_key(r):r for r in json.load(fp)['results']}
+
+    regressions = 0
+    print(f'\n{"case":<36}{"assets":>8}{"bars":>6}{"before":>10}'
+          f'{"after":>10}{"ratio":>8}')
+    for result in results:
+        before = baseline.get(_key(result))
+        if before is None:
+            continue
+        ratio = result['min_ms']/before['min_ms']
+        flag = ' <- regression' if ratio > threshold else ''
+        regressions += bool(flag)
+        print(f'{result["case"]:<36}{result["assets"]:>8}{result["bars"]:>6}'
+              f'{before["min_ms"]:>10.3f}{result["min_ms"]:>10.3f}'
+              f'{ratio:>8.2f}{flag}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--assets', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--bars', type=int, nargs='+', default=[20, 126, 504])
+    parser.add_argument('--nan-fraction', type=float, default=0.02)
+    parser.add_argument('--days', type=int, default=6,
+                        help='consecutive days (calls) per case')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES),
+                        default=list(CASES))
+    parser.add_argument('--output', help='save results as JSON')
+    parser.add_argument('--compare', help='compare with saved results')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slow-down ratio flagged as regression')
+    args = parser.parse_args()
+
+    custom = load_custom()
+    register_kernels(custom)
+    results = []
+    print(f'{"case":<36}{"assets":>8}{"bars":>6}{"mean (ms)":>11}'
+          f'{"min (ms)":>10}{"peak (KiB)":>12}{"blocks":>8}')
+    for case in args.cases:
+        for assets in args.assets:
+            for bars in args.bars:
+                result = run_case(custom, case, assets, bars,
+                                  args.nan_fraction, args.days)
+                results.append(result)
+                print(f'{case:<36}{assets:>8}{bars:>6}'
+                      f'{result["mean_ms"]:>11.3f}{result["min_ms"]:>10.3f}'
+                      f'{result["peak_kib"]:>12.1f}{result["net_blocks"]:>8}')
+
+    if args.output:
+        meta = {'python':platform.python_version(), 'numpy':np.__version__,
+                'platform':platform.platform(), 'time':time.time(),
+                'cpu_count':os.cpu_count()}
+        with open(args.output, 'w') as fp:
+            json.dump({'meta':meta, 'results':results}, fp, indent=1)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmark `technical_factor` with the batched kernels against the 
+per-asset `np.apply_along_axis` path, on synthetic random-walk prices.
+
+    python benchmarks/bench_technical_factor.py --assets 2000 --window 252
+"""
+import argparse
+import timeit
+import warnings
+
+import numpy as np
+
+from _standins import load_custom
+from _synthetic import (make_prices, register_kernels, sma, rsi, ema, roc, 
+                        volatility, skewness, skew)
+
+CASES = [(sma, 20), (rsi, 14), (ema, 20), (roc, 20), (volatility, 1)]
+if skew is not None:
+    CASES.append((skewness, None))
+
+def run(custom, window, assets, nan_fraction, number):
+    px = make_prices(window, assets, nan_fraction)
+    out = np.empty(assets)
+    print(f'{"indicator":<12}{"per-asset (ms)":>16}{"batched (ms)":>16}'
+          f'{"speed-up":>10}{"max abs err":>14}')
+    for fn, n in CASES:
+        baseline = lambda:np.apply_along_axis(fn, 0, px, n)
+        factor = custom.technical_factor(window, fn, n)
+        batched = lambda:factor.compute(None, None, out, px)
+        
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            expected = baseline()
+            batched()
+            t0 = min(timeit.repeat(baseline, number=number, repeat=3))/number
+            t1 = min(timeit.repeat(batched, number=number, repeat=3))/number
+        err = np.nanmax(np.abs(out - expected))
+        print(f'{fn.__name__:<12}{1000*t0:>16.2f}{1000*t1:>16.2f}'
+              f'{t0/t1:>9.1f}x{err:>14.2e}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--assets', type=int, default=2000)
+    parser.add_argument('--window', type=int, default=252)
+    parser.add_argument('--nan-fraction', type=float, default=0.02)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+    
+    custom = load_custom()
+    register_kernels(custom)
+    run(custom, args.window, args.assets, args.nan_fraction, args.number)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Checks that the agent weighs the advisors on their full P&L history, as
+the baseline Kelly agent did, unless a window is given.
+
+    python -m pytest benchmarks
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from _standins import load_strategy
+
+@pytest.fixture(scope='module')
+def portfolio():
+    return load_strategy('portfolio/kelly_portfolio.py')
+
+def _baseline_kelly(perfs):
+    # the weighing function of the baseline (DataFrame) agent
+    kelly = {}
+    for name in perfs.columns:
+        initial, final = perfs[name].iloc[0], perfs[name].iloc[-1]
+        ret = (final/initial)**(1.0/len(perfs)) - 1
+        variance = perfs[name].pct_change().dropna().var()
+        kelly[name] = round(max(ret/variance, 0.0), 4)
+    total = sum(kelly.values())
+    return {name:value/total for name, value in kelly.items()}
+
+def _agent(portfolio, monkeypatch, records, **kwargs):
+    advisors = [portfolio.Advisor(f'a{i}', None, ['A']) for i in range(3)]
+    agent = portfolio.Agent(advisors, 'kelly', lookback=20, **kwargs)
+    rng = np.random.default_rng(7)
+    perfs = 100*np.cumprod(1 + rng.normal([1E-3, 2E-3, 5E-4], 1E-2,
+                                          (records, 3)), axis=0)
+    dates = pd.date_range('2024-01-01', periods=records)
+    for dt, row in zip(dates, perfs):
+        monkeypatch.setattr(portfolio, 'get_datetime', lambda dt=dt:dt)
+        agent.ledger.perfs[:] = row
+        agent.update_pnl_history()
+    return agent, pd.DataFrame(perfs, columns=agent.advisors_keys)
+
+def test_full_history_by_default(portfolio, monkeypatch):
+    agent, perfs = _agent(portfolio, monkeypatch, 150)
+    expected = _baseline_kelly(perfs)
+    weights = agent.weighing_function()
+    assert weights == pytest.approx(expected, rel=1E-9)
+
+def test_window_opt_in(portfolio, monkeypatch):
+    agent, perfs = _agent(portfolio, monkeypatch, 150, window=60)
+    expected = _baseline_kelly(perfs.iloc[-60:])
+    weights = agent.weighing_function()
+    assert weights == pytest.approx(expected, rel=1E-9)
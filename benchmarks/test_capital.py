@@ -0,0 +1,140 @@
+"""
+Checks of the capital allocation in `events/algo-convention-2025-09-27`:
+the weight projection, the netting of the capital transfers and the
+first day funding of the sub-strategies.
+
+    python -m pytest benchmarks
+"""
+import numpy as np
+import pytest
+
+from _standins import install_library, load_strategy
+
+install_library()
+capital = load_strategy('events/algo-convention-2025-09-27/capital.py')
+
+def _bisection(target, lower, upper):
+    """ the projection, with the shift found by bisection. """
+    low, high = -2.0, 2.0
+    for _ in range(200):
+        shift = (low + high)/2
+        if np.clip(target + shift, lower, upper).sum() < 1:
+            low = shift
+        else:
+            high = shift
+    return np.clip(target + high, lower, upper)
+
+def test_projection():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        n = rng.integers(1, 40)
+        lower, upper = rng.uniform(0, 0.1), rng.uniform(0.05, 1)
+        target = rng.random(n)**3
+        target[rng.random(n) < 0.1] = 0
+        target[0] += 1E-3
+        target /= target.sum()
+        
+        weights = capital.project_capped_simplex(target, lower, upper)
+        lower, upper = min(lower, 1/n), max(upper, 1/n)
+        assert weights.sum() == pytest.approx(1, abs=1E-12)
+        assert (weights >= lower - 1E-15).all()
+        assert (weights <= upper + 1E-15).all()
+        np.testing.assert_allclose(
+                weights, _bisection(target, lower, upper), atol=1E-9)
+
+@pytest.fixture
+def transfers(monkeypatch):
+    """ the requested transfers, all granted. """
+    requested = []
+    monkeypatch.setattr(capital, 'fund_transfer', 
+                        lambda amount:requested.append(amount) or amount)
+    return requested
+
+def test_transfer_netting(transfers):
+    planner = capital.TransferPlanner()
+    plan = planner.make_plan(
+            {'a':-500.004, 'b':300, 'c':700, 'd':0.3, 'e':-0.5, 'f':250},
+            cash=800)
+    
+    # one transfer per strategy, below min_transfer skipped, the largest
+    # additions funded from the cash, the rest from the releases
+    assert sorted(plan) == sorted([
+            ('a', 'release', -500.0), ('c', 'open', 700),
+            ('b', 'fund', 300), ('f', 'fund', 250)])
+    
+    assert planner.execute('b', 'open') == 0
+    for name, phase in [('c', 'open'), ('a', 'release'), ('b', 'fund'), 
+                        ('f', 'fund')]:
+        planner.execute(name, phase)
+    assert planner.execute('c', 'open') == 0
+    assert transfers == [700, -500.0, 300, 250]
+    assert planner.settle() == 750
+    assert planner.settle() == 0
+    assert planner.plan == [] and planner.pending() == {}
+
+def test_pending_transfers_carried(transfers):
+    planner = capital.TransferPlanner()
+    planner.make_plan({'a':300, 'b':-100}, cash=0)
+    planner.execute('b', 'release')
+    planner.make_plan({'a':50, 'c':20}, cash=500)
+    assert sorted(planner.plan) == [('a', 'open', 350), ('c', 'open', 20)]
+    assert planner.amounts == {'a':350, 'c':20}
+
+def test_fund_phase_netted(transfers):
+    """ the fund additions never draw more than the cash pool and the 
+        releases of the day, the rest is carried to the next plan. """
+    planner = capital.TransferPlanner()
+    planner.make_plan({'a':-50, 'b':300, 'c':80}, cash=100)
+    assert sorted(planner.plan) == [('a', 'release', -50), ('b', 'fund', 300),
+                                    ('c', 'open', 80)]
+    planner.execute('c', 'open')
+    planner.execute('a', 'release')
+    assert planner.execute('b', 'fund') == 70
+    assert planner.deferred == {'b':230}
+    assert planner.settle() == 100
+    assert planner.available() == 0
+    
+    planner.make_plan({'b':20}, cash=400)
+    assert planner.plan == [('b', 'open', 250)]
+    assert planner.deferred == {}
+
+class Portfolio():
+    def __init__(self, value, starting_cash=0):
+        self.portfolio_value = value
+        self.starting_cash = starting_cash
+
+class Context():
+    def __init__(self, value, starting_cash=0):
+        self.portfolio = Portfolio(value, starting_cash)
+
+@pytest.mark.parametrize('strategies_first', [True, False])
+def test_first_day_funding(monkeypatch, transfers, strategies_first):
+    """ the initial capital reaches every strategy on the first day, 
+        whether the strategies initialize before the first `compute` or 
+        after it. """
+    names = [f's{i}' for i in range(7)]
+    context = Context(0, starting_cash=1000)
+    monkeypatch.setattr(capital, 'get_context', lambda name:Context(0))
+    
+    allocator = capital.CapitalAllocator(context)
+    allocator.compute_metrics = lambda name, sub_context:None
+    context.strategies = [capital.AdvisorStrategy(name, None, allocator) \
+                          for name in names]
+    
+    allocator.initialize()
+    if strategies_first:
+        for strategy in context.strategies:
+            strategy.initialize(context)
+    allocator.compute()
+    if not strategies_first:
+        for strategy in context.strategies:
+            strategy.initialize(context)
+    for stage in ['before_trading_start', 'start_trading', 'fund_capital']:
+        for strategy in context.strategies:
+            getattr(strategy, stage)(context, None)
+    
+    # 1000 split as 142 + 6x143, all funded from the cash pool at the open
+    assert transfers[0] == -1000
+    assert sorted(transfers[1:]) == [142] + [143]*6
+    assert allocator.transfers.plan == []
+    assert allocator.cash - allocator.transfers.settle() == 0
@@ -0,0 +1,121 @@
+"""
+Checks that the pipeline cache keys tell apart pipelines that compute
+different outputs, including after a change to the builder source, and
+that terms which cannot be fingerprinted are not cached.
+
+    python -m pytest benchmarks
+"""
+import os
+import shutil
+import threading
+import importlib.util
+
+from _standins import (load_custom, load_cache, Asset, Context, CustomFactor,
+                       ROOT)
+
+custom = load_custom()
+cache = load_cache()
+context = Context()
+
+class Pipeline():
+    def __init__(self, columns, screen=None):
+        self.columns = columns
+        self.screen = screen
+
+def _keys(tmp_path, pipeline):
+    store = cache.PipelineCache(Context(), str(tmp_path))
+    store.attach_pipeline(pipeline, 'pipeline')
+    return store.pipelines.get('pipeline')
+
+def test_same_terms_same_key():
+    universe = [Asset(1), Asset(2)]
+    assert cache.fingerprint(custom.filter_universe(universe, context)) == \
+        cache.fingerprint(custom.filter_universe(list(universe), context))
+    assert cache.fingerprint(custom.technical_factor(20, custom.batch_rsi)) \
+        == cache.fingerprint(custom.technical_factor(20, custom.batch_rsi))
+
+def test_universe_changes_key():
+    assert cache.fingerprint(custom.filter_universe([Asset(1)], context)) != \
+        cache.fingerprint(custom.filter_universe([Asset(2)], context))
+    assert cache.fingerprint(custom.exclude_assets([Asset(1)], context)) != \
+        cache.fingerprint(custom.exclude_assets([Asset(2)], context))
+
+def test_arguments_change_key():
+    assert cache.fingerprint(custom.average_volume_filter(20, 1E7)) != \
+        cache.fingerprint(custom.average_volume_filter(20, 1E8))
+    assert cache.fingerprint(custom.returns_factor(20)) != \
+        cache.fingerprint(custom.returns_factor(20, offset=1))
+    
+    def above(level):
+        return lambda asset:asset.sid > level
+    assert cache.fingerprint(custom.filter_assets(above(1), context)) != \
+        cache.fingerprint(custom.filter_assets(above(2), context))
+
+def test_nested_masks_change_key():
+    def nested(sid):
+        term = custom.filter_universe([Asset(sid)], context)
+        for _ in range(12):
+            term = custom.returns_factor(20, mask=term)
+        return term
+    assert cache.fingerprint(nested(1)) != cache.fingerprint(nested(2))
+
+def _load_copy(path):
+    shutil.copy(os.path.join(ROOT, 'piplines', 'custom.py'), path)
+    spec = importlib.util.spec_from_file_location('custom_copy', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_builder_source_changes_key(tmp_path):
+    path = str(tmp_path/'custom.py')
+    module = _load_copy(path)
+    key = cache.fingerprint(module.returns_factor(20))
+    assert key == cache.fingerprint(_load_copy(path).returns_factor(20))
+    
+    # e.g. a fix in a kernel the builder uses
+    with open(path, 'a') as fp:
+        fp.write('\n# changed\n')
+    assert cache.fingerprint(module.returns_factor(20)) != key
+
+def test_builder_without_source(tmp_path):
+    path = str(tmp_path/'custom.py')
+    module = _load_copy(path)
+    os.remove(path)
+    key = cache.fingerprint(module.returns_factor(20))
+    assert key is not None
+    assert key == cache.fingerprint(module.returns_factor(20))
+    assert key != cache.fingerprint(module.returns_factor(21))
+
+class Locked(CustomFactor):
+    window_length = 2
+    
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+
+def test_undescribable_term():
+    assert cache.fingerprint(Locked()) is None
+    assert cache.fingerprint(custom.returns_factor(20, mask=Locked())) is None
+
+def test_pipeline_keys(tmp_path):
+    columns = {'returns':custom.returns_factor(20)}
+    first = _keys(tmp_path, Pipeline(
+            columns, custom.filter_universe([Asset(1)], context)))
+    second = _keys(tmp_path, Pipeline(
+            columns, custom.filter_universe([Asset(2)], context)))
+    third = _keys(tmp_path, Pipeline(
+            columns, custom.average_volume_filter(20, 1E7)))
+    again = _keys(tmp_path, Pipeline(
+            columns, custom.filter_universe([Asset(1)], context)))
+    
+    assert first == again
+    screens = {first[0], second[0], third[0]}
+    assert len(screens) == 3
+    columns = {first[1]['returns'], second[1]['returns'], 
+               third[1]['returns']}
+    assert len(columns) == 3
+
+def test_uncacheable_pipeline(tmp_path):
+    assert _keys(tmp_path, Pipeline({'locked':Locked()})) is None
+    assert _keys(tmp_path, Pipeline(
+            {'returns':custom.returns_factor(20)}, Locked())) is None
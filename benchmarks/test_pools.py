@@ -0,0 +1,144 @@
+"""
+Checks that the worker pools compute the same results as the serial
+evaluation, and that they are shut down cleanly.
+
+    python -m pytest benchmarks
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from _standins import install_library, load_strategy
+from bench_advisor_pool import History, Context
+
+PARAMS = {'indicator_lookback':375, 'indicator_freq':'1m',
+          'buy_signal_threshold':0.5, 'sell_signal_threshold':-0.5,
+          'SMA_period_short':15, 'SMA_period_long':60, 'BBands_period':300,
+          'ADX_period':120, 'leverage':1}
+
+@pytest.fixture(scope='module')
+def portfolio():
+    return load_strategy('portfolio/kelly_portfolio.py')
+
+def _run_agent(module, workers, lookbacks):
+    context = Context()
+    context.universe = ['A', 'B', 'C']
+    context.params = dict(PARAMS)
+    data = History(context.universe, 900)
+    experts = [module.expert_advisor_1, module.expert_advisor_2,
+               module.expert_advisor_3, module.expert_advisor_4]
+    advisors = [module.Advisor(expert.__name__, expert, context.universe) \
+                for expert in experts]
+    
+    results = []
+    with module.Agent(advisors, workers=workers) as agent:
+        pool = agent.pool
+        for end, lookback in zip(range(450, 900, 15), lookbacks):
+            # a longer lookback moves the pool to a larger shared segment
+            context.params['indicator_lookback'] = lookback
+            data.end = end
+            agent.compute_weights(context, data)
+            results.append([context.weights[asset] for asset in context.universe] \
+                           + [advisor.perf for advisor in advisors])
+    return pool, np.array(results)
+
+def test_advisor_pool_matches_serial(portfolio):
+    lookbacks = [375]*10 + [400]*10 + [450]*10
+    _, serial = _run_agent(portfolio, None, lookbacks)
+    pool, pooled = _run_agent(portfolio, 2, lookbacks)
+    
+    assert np.array_equal(serial, pooled)
+    # closed on leaving the agent block
+    assert pool.procs == [] and pool.shm is None
+
+def test_advisor_pool_errors(portfolio):
+    def failing(px, params):
+        raise RuntimeError('advisor failed')
+    
+    context = Context()
+    context.universe = ['A']
+    context.params = dict(PARAMS)
+    data = History(context.universe, 400)
+    data.end = 400
+    advisors = [portfolio.Advisor('ema', portfolio.expert_advisor_2, ['A']),
+                portfolio.Advisor('failing', failing, ['A'])]
+    with portfolio.Agent(advisors, workers=2) as agent:
+        with pytest.raises(RuntimeError):
+            agent.compute_weights(context, data)
+
+class CloseHistory():
+    """ data.history stand-in over synthetic close prices. """
+    def __init__(self, assets, bars, seed=3):
+        rng = np.random.default_rng(seed)
+        self.index = pd.date_range('2024-01-01 09:15', periods=bars, freq='min')
+        self.closes = {asset:100*np.exp(np.cumsum(rng.normal(0, 1E-3, bars))) \
+                       for asset in assets}
+        self.end = 0
+        
+    def history(self, assets, fields, nbars, freq):
+        window = slice(self.end-nbars, self.end)
+        return pd.DataFrame({asset:self.closes[asset][window] for asset in assets},
+                            index=self.index[window])
+
+@pytest.fixture(scope='module')
+def capital():
+    install_library()
+    return load_strategy('events/algo-convention-2025-09-27/capital.py')
+
+def _run_strategies(capital, monkeypatch, workers):
+    data = CloseHistory(['RELIANCE', 'INFY'], 600)
+    monkeypatch.setattr(capital, 'get_datetime', lambda:data.index[data.end-1])
+    
+    pool = capital.StrategyPool(workers) if workers else None
+    shared_data = capital.SharedData()
+    advisors = [capital.advisor_bbands, capital.advisor_rsi, capital.advisor_ma]
+    strategies = [capital.AdvisorStrategy(f's{i}', advisors[i % 3], None, 
+                                          shared_data, pool) for i in range(9)]
+    for strategy in strategies:
+        strategy.securities = ['RELIANCE', 'INFY']
+        strategy.can_trade = True
+        strategy.rebalance = lambda context, data:None
+    
+    results = []
+    try:
+        for end in range(400, 600, 5):
+            data.end = end
+            for strategy in strategies:
+                strategy.run_strategy(None, data)
+            results.append([(dict(s.signals), dict(s.target_position)) \
+                            for s in strategies])
+    finally:
+        if pool is not None:
+            pool.close()
+    return results
+
+def test_strategy_pool_matches_serial(capital, monkeypatch):
+    serial = _run_strategies(capital, monkeypatch, None)
+    
+    # with the pool, every strategy reads its results from the workers
+    def computed_locally(self, context, data):
+        raise AssertionError('signals computed outside the pool')
+    monkeypatch.setattr(capital.AdvisorStrategy, 'generate_signals', 
+                        computed_locally)
+    pooled = _run_strategies(capital, monkeypatch, 2)
+    assert serial == pooled
+    assert any(targets for bar in serial for _, targets in bar)
+
+def test_strategy_pool_closed_on_analyze(capital, monkeypatch):
+    data = CloseHistory(['RELIANCE'], 450)
+    data.end = 450
+    monkeypatch.setattr(capital, 'get_datetime', lambda:data.index[data.end-1])
+    
+    class Context():
+        pool = capital.StrategyPool(2)
+    strategy = capital.AdvisorStrategy('s0', capital.advisor_ma, None, 
+                                       capital.SharedData(), Context.pool)
+    strategy.securities = ['RELIANCE']
+    strategy.can_trade = True
+    Context.pool.get_results(strategy, data)
+    procs = list(Context.pool.procs)
+    assert procs
+    
+    capital.analyze(Context, None)
+    assert Context.pool.procs == []
+    assert not any(proc.is_alive() for proc in procs)
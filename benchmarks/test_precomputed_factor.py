@@ -0,0 +1,40 @@
+"""
+Checks of `precomputed_factor`: the stacked sliding-window indicator panel
+against one kernel call per window, and a panel with no assets.
+
+    python -m pytest benchmarks
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from _standins import load_custom
+from _synthetic import make_prices
+
+custom = load_custom()
+
+def _panel_by_window(close, lookback, kernel, indicator_lookback):
+    out = np.full(close.shape, np.nan)
+    for end in range(lookback, len(close)+1):
+        out[end-1] = kernel(close[end-lookback:end], indicator_lookback)
+    return out
+
+@pytest.mark.parametrize('block', [2**22, 1000, 1])
+@pytest.mark.parametrize('kernel, lookback, indicator_lookback', [
+        (custom.batch_ema, 30, 10), (custom.batch_rsi, 40, 14)])
+def test_panel_indicator(monkeypatch, block, kernel, lookback,
+                         indicator_lookback):
+    monkeypatch.setattr(custom, '_PANEL_BLOCK', block)
+    close = make_prices(120, 25, 0.1)
+    with np.errstate(all='ignore'):
+        expected = _panel_by_window(close, lookback, kernel, indicator_lookback)
+    panel = custom.panel_indicator(close, lookback, kernel, indicator_lookback)
+    np.testing.assert_allclose(panel, expected, rtol=1E-12, equal_nan=True)
+
+def test_no_assets():
+    dates = pd.date_range('2024-01-01', periods=30)
+    close = pd.DataFrame(np.empty((30, 0)), index=dates)
+    factor = custom.precomputed_factor(10, 'returns', close)
+    out = np.zeros(3)
+    factor.compute(dates[-1], np.array([1, 2, 3]), out)
+    assert np.isnan(out).all()
@@ -0,0 +1,43 @@
+"""
+Checks that `shared_terms` shares the stateless pipeline terms only, and
+that `select_universe` uses the built-in dollar volume factor.
+
+    python -m pytest benchmarks
+"""
+import numpy as np
+
+from _standins import load_custom, Asset, Context
+from _synthetic import make_prices, make_volumes
+
+custom = load_custom()
+context = Context()
+
+def test_stateless_terms_shared():
+    with custom.shared_terms():
+        assert custom.average_volume_factor(20, 0) is \
+            custom.average_volume_factor(20, 1E7)
+        assert custom.returns_factor(20) is custom.returns_factor(20)
+        assert custom.select_universe(20, 10) is custom.select_universe(20, 10)
+    assert custom.returns_factor(20) is not custom.returns_factor(20)
+
+def test_stateful_terms_not_shared():
+    universe = [Asset(1), Asset(2)]
+    with custom.shared_terms():
+        assert custom.average_volume_factor(20, 0, incremental=True) is not \
+            custom.average_volume_factor(20, 0, incremental=True)
+        assert custom.average_volume_filter(20, 1E7, incremental=True) is not \
+            custom.average_volume_filter(20, 1E7, incremental=True)
+        assert custom.filter_universe(universe, context) is not \
+            custom.filter_universe(universe, context)
+        assert custom.exclude_assets(universe, context) is not \
+            custom.exclude_assets(universe, context)
+
+def test_select_universe_dollar_volume():
+    close, volume = make_prices(20, 50, 0.1), make_volumes(20, 50, 0.1)
+    term = custom.select_universe(20, 10)
+    out = np.empty(50, dtype=bool)
+    term.compute(None, np.arange(50), out, close, volume)
+
+    # the top assets by the built-in average, where NaNs count as zero
+    average = np.nansum(close * volume, axis=0)/len(close)
+    assert set(np.flatnonzero(out)) == set(np.argsort(-average)[:10])
@@ -0,0 +1,121 @@
+"""
+Checks that `technical_factor` computes the library indicators, and the
+indicators with a registered kernel, with the batched kernels, with the
+same values as the per-asset computation, and that other functions are
+never substituted by name.
+
+    python -m pytest benchmarks
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+from _standins import install_library, load_custom
+from _synthetic import (make_prices, register_kernels, sma, rsi, ema, roc,
+                        volatility, skewness)
+
+install_library()
+custom = load_custom()
+register_kernels(custom)
+
+from blueshift.library.technicals import indicators
+
+def price_range(px, lookback):
+    return px[-lookback:].max() - px[-lookback:].min()
+
+def _check_batched(monkeypatch, indicator, lookback):
+    assert custom.get_batch_kernel(indicator) is not None
+
+    px = make_prices(252, 300, 0.02)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = np.apply_along_axis(indicator, 0, px, lookback)
+    factor = custom.technical_factor(252, indicator, lookback)
+    out = np.empty(px.shape[1])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', UserWarning)
+        warnings.simplefilter('ignore', RuntimeWarning)
+        factor.compute(None, None, out, px)
+
+        # once checked, the complete columns are computed in one go
+        calls = []
+        apply = np.apply_along_axis
+        monkeypatch.setattr(np, 'apply_along_axis',
+                            lambda fn, axis, px, *args:calls.append(px.shape) \
+                                or apply(fn, axis, px, *args))
+        factor.compute(None, None, out, px)
+
+    complete = np.isfinite(px).all(axis=0)
+    assert sum(shape[1] for shape in calls) == (~complete).sum()
+    np.testing.assert_allclose(out, expected, rtol=1E-6, atol=1E-8)
+
+@pytest.mark.parametrize('name, lookback', [('ema', 20), ('rsi', 14)])
+def test_library_indicators_batched(monkeypatch, name, lookback):
+    _check_batched(monkeypatch, getattr(indicators, name), lookback)
+
+@pytest.mark.parametrize('name, lookback', [
+        ('sma', 20), ('ema', 20), ('rsi', 14), ('roc', 20),
+        ('volatility', 1), ('volatility', 5)])
+def test_library_indicators_optional(monkeypatch, name, lookback):
+    # only with the library installed, not all are in the stand-ins
+    indicator = getattr(indicators, name, None)
+    if indicator is None:
+        pytest.skip(f'no {name} in the technicals library')
+    _check_batched(monkeypatch, indicator, lookback)
+
+@pytest.mark.parametrize('indicator, lookback', [
+        (sma, 20), (rsi, 14), (ema, 20), (roc, 20), (volatility, 1),
+        (volatility, 5), (custom.batch_sma, 20)])
+def test_registered_indicators_batched(monkeypatch, indicator, lookback):
+    _check_batched(monkeypatch, indicator, lookback)
+
+def test_skewness_batched(monkeypatch):
+    pytest.importorskip('scipy')
+    _check_batched(monkeypatch, skewness, None)
+
+def test_volatility_lookback():
+    px = make_prices(60, 20)
+    assert not np.allclose(custom.batch_volatility(px, 1),
+                           custom.batch_volatility(px, 5))
+
+def test_same_name_not_substituted():
+    def ema(px, lookback):
+        return px[-1]
+
+    assert custom.get_batch_kernel(ema) is None
+    px = make_prices(60, 50)
+    out = np.empty(px.shape[1])
+    custom.technical_factor(60, ema, 20).compute(None, None, out, px)
+    np.testing.assert_allclose(out, px[-1])
+
+def test_unknown_indicator_per_asset():
+    assert custom.get_batch_kernel(price_range) is None
+    px = make_prices(60, 50, 0.0)
+    out = np.empty(px.shape[1])
+    custom.technical_factor(60, price_range, 20).compute(None, None, out, px)
+    np.testing.assert_allclose(
+            out, np.apply_along_axis(price_range, 0, px, 20))
+
+@pytest.mark.parametrize('indicator, lookbacks', [
+        (indicators.ema, (5, 20, 50)), (indicators.rsi, (7, 14)),
+        (sma, (5, 20)), (roc, (1, 5, 20)), (ema, (10, 30))])
+def test_multi_lookback_kernels(indicator, lookbacks):
+    kernel = custom.get_multi_kernel(indicator)
+    assert kernel is not None
+    px = make_prices(126, 100)
+    expected = np.stack([np.apply_along_axis(indicator, 0, px, n) \
+                         for n in lookbacks])
+    np.testing.assert_allclose(kernel(px, lookbacks), expected,
+                               rtol=1E-6, atol=1E-8)
+
+def test_multi_lookback_same_name_not_substituted():
+    def ema(px, lookback):
+        return px[-1]
+
+    assert custom.get_multi_kernel(ema) is None
+    px = make_prices(60, 10)
+    factor = custom.multi_lookback_factor(60, ema, [5, 20])
+    out = {name:np.empty(10) for name in factor.outputs}
+    factor.compute(None, None, out, px)
+    np.testing.assert_allclose(out['ema_5'], px[-1])
@@ -1,12 +1,16 @@
 from blueshift.api import order_target_percent, symbol, get_context
 from blueshift.api import schedule_function, date_rules, time_rules
 from blueshift.api import set_commission, set_slippage, record
-from blueshift.api import fund_transfer, add_strategy
+from blueshift.api import fund_transfer, add_strategy, get_datetime
 from blueshift.protocol import Strategy
 from blueshift.finance import commission, slippage
 from blueshift.library.technicals.indicators import bbands, ema, rsi
 
+import os
+import atexit
 import numpy as np
+import pandas as pd
+from collections import deque
 
 def fixed_weight(perfs):
     return
@@ -15,21 +19,239 @@ def equal_weight(perfs):
     return 1
 
 def growth(perfs):
-    cum_rets = perfs['algo_cum_returns'].iloc[-1]
+    cum_rets = perfs.cum_returns
     return np.log(1 + max(0, cum_rets))
 
 def kelly(perfs):
-    rets = perfs['algo_returns'].mean()
-    var = perfs['algo_returns'].var()
+    rets = perfs.mean
+    var = perfs.var
     return max(0, rets/var)
 
 def sharpe(perfs):
-    n = len(perfs)
-    cum_rets = 1+ perfs['algo_cum_returns'].iloc[-1]
+    n = perfs.count
+    cum_rets = 1+ perfs.cum_returns
     cum_rets = cum_rets**(1/n) - 1
-    vol = perfs['algo_returns'].std()
+    vol = perfs.std
     return max(0, cum_rets/vol)
 
+def project_capped_simplex(target, lower, upper):
+    """
+        Euclidean projection of the target weights on the capped simplex
+        {w: sum(w) = 1, lower <= w <= upper}, i.e. w = clip(target + c, lower,
+        upper) with the shift c such that the weights sum to 1. The sum is a
+        piecewise linear function of c, with breakpoints at lower - target and
+        upper - target, so c is found exactly after sorting the breakpoints.
+        If the bounds cannot hold for the number of weights, they are relaxed
+        to 1/n.
+    """
+    target = np.asarray(target, dtype=np.float64)
+    n = len(target)
+    lower, upper = min(lower, 1/n), max(upper, 1/n)
+    
+    # the sum is const + slope*c after each breakpoint, in sorted order
+    points = np.concatenate([lower - target, upper - target])
+    order = np.argsort(points, kind='stable')
+    points = points[order]
+    slope = np.cumsum(np.repeat([1, -1], n)[order])
+    const = n*lower + np.cumsum(
+            np.concatenate([target - lower, upper - target])[order])
+    totals = const + slope*points
+    
+    k = min(np.searchsorted(totals, 1), 2*n-1)
+    if k == 0 or totals[k] == 1:
+        shift = points[k]
+    else:
+        shift = (1 - const[k-1])/slope[k-1]
+    return np.clip(target + shift, lower, upper)
+
+def exponential_allocation(metrics, weights, nu, lower, upper, incremental=True):
+    """
+        New weights of the strategies from their metrics and current weights,
+        with the exponential (multiplicative) update, or in proportion to the
+        metrics if not `incremental`, projected on the weight bounds.
+    """
+    metrics = np.asarray(metrics, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if incremental:
+        exponent = nu*metrics/(metrics @ weights)
+        updates = np.exp(exponent - exponent.max())*weights
+    else:
+        updates = metrics
+    return project_capped_simplex(updates/updates.sum(), lower, upper)
+
+class RollingMetrics:
+    """
+        Rolling statistics of the daily returns of a strategy over the last
+        `lookback` days, and its cumulative returns, updated in O(1) per new
+        day from the strategy `pnls`. The mean and variance of the returns
+        (NaNs skipped, as in pandas) are Welford accumulators, re-computed
+        from the window every `lookback` updates to stop rounding errors
+        from accumulating.
+    """
+    def __init__(self, lookback):
+        self.lookback = lookback
+        self.window = deque()
+        self.n = 0
+        self.mean = np.float64(0)
+        self.m2 = np.float64(0)
+        self.cum_returns = np.nan
+        self.last_dt = None
+        self.updates = 0
+        
+    @property
+    def count(self):
+        return len(self.window)
+    
+    @property
+    def var(self):
+        return max(self.m2, 0)/(self.n - 1) if self.n > 1 else np.nan
+    
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+    
+    def update(self, pnls):
+        start = 0
+        if self.last_dt is not None:
+            start = pnls.index.searchsorted(self.last_dt, side='right')
+        if start >= len(pnls):
+            return self
+        
+        # only the latest `lookback` days stay in the window
+        start = max(start, len(pnls) - self.lookback)
+        for ret in pnls['algo_returns'].values[start:]:
+            self.push(ret)
+        self.cum_returns = pnls['algo_cum_returns'].values[-1]
+        self.last_dt = pnls.index[-1]
+        return self
+        
+    def push(self, ret):
+        if len(self.window) == self.lookback:
+            self._remove(self.window.popleft())
+        self.window.append(ret)
+        self._add(ret)
+        
+        self.updates += 1
+        if self.updates % self.lookback == 0:
+            self._reset()
+            
+    def _add(self, ret):
+        if np.isnan(ret):
+            return
+        self.n += 1
+        delta = ret - self.mean
+        self.mean += delta/self.n
+        self.m2 += delta*(ret - self.mean)
+        
+    def _remove(self, ret):
+        if np.isnan(ret):
+            return
+        self.n -= 1
+        if self.n == 0:
+            self.mean = self.m2 = np.float64(0)
+            return
+        delta = ret - self.mean
+        self.mean -= delta/self.n
+        self.m2 -= delta*(ret - self.mean)
+        
+    def _reset(self):
+        rets = np.array(self.window, dtype=np.float64)
+        rets = rets[~np.isnan(rets)]
+        self.n = len(rets)
+        self.mean = rets.mean() if self.n else np.float64(0)
+        self.m2 = ((rets - self.mean)**2).sum()
+
+class TransferPlanner:
+    """
+        Plans the capital transfers of a day between the allocator cash pool
+        and the sub-strategies, from their capital changes, as at most one
+        transfer per strategy in one of three phases: `open` for additions
+        the cash pool can fund before the market opens, `release` for
+        releases (after the positions are reduced) and `fund` for additions
+        funded by the releases of the day. Each phase is netted through the
+        cash pool: a `fund` addition is capped to the cash left after the
+        transfers executed so far, and the rest is `deferred` to the next
+        plan. Changes smaller than `min_transfer` are skipped, they are part
+        of the next day changes. The strategies execute their own transfers,
+        and the cash pool is updated once with `settle`. The plan is a list
+        of (name, phase, amount) in `plan`, and the executed transfers are
+        in `executed`. Planned transfers not yet executed (e.g. the first
+        day funding if the plan is made again before the strategies run)
+        and the deferred ones are `pending`, and are added to the changes
+        of the next plan.
+    """
+    OPEN = 'open'
+    RELEASE = 'release'
+    FUND = 'fund'
+    
+    def __init__(self, min_transfer=1.0):
+        self.min_transfer = min_transfer
+        self.cash = 0
+        self.plan = []
+        self.amounts = {}
+        self.executed = []
+        self.deferred = {}
+        
+    def pending(self):
+        amounts = dict(self.deferred)
+        for k, _, amount in self.plan:
+            amounts[k] = amounts.get(k, 0) + amount
+        return amounts
+    
+    def available(self):
+        # the cash pool net of the transfers not yet settled
+        return round(self.cash - sum(executed[-1] for executed in self.executed), 2)
+        
+    def make_plan(self, changes, cash):
+        pending = self.pending()
+        self.deferred = {}
+        self.cash = cash
+        cash = self.available()
+        changes = {k:changes.get(k, 0) + pending.get(k, 0) \
+                   for k in {**pending, **changes}}
+        changes = {k:round(v, 2) for k,v in changes.items() \
+                   if abs(v) >= self.min_transfer}
+        releases = [k for k in changes if changes[k] < 0]
+        additions = sorted([k for k in changes if changes[k] > 0],
+                           key=changes.get, reverse=True)
+        
+        plan = [(k, self.RELEASE, changes[k]) for k in releases]
+        for k in additions:
+            if changes[k] <= cash:
+                plan.append((k, self.OPEN, changes[k]))
+                cash -= changes[k]
+            else:
+                plan.append((k, self.FUND, changes[k]))
+                
+        self.plan = plan
+        self.amounts = changes
+        return plan
+    
+    def execute(self, name, phase):
+        for i, (k, planned_phase, amount) in enumerate(self.plan):
+            if k == name and planned_phase == phase:
+                del self.plan[i]
+                if phase == self.FUND:
+                    funded = min(amount, max(self.available(), 0))
+                    if funded < self.min_transfer:
+                        funded = 0
+                    if amount - funded:
+                        self.deferred[k] = round(amount - funded, 2)
+                    if not funded:
+                        return 0
+                    amount = funded
+                transferred = fund_transfer(amount)
+                self.executed.append((name, phase, amount, round(transferred, 2)))
+                return transferred
+        return 0
+    
+    def settle(self):
+        # total transferred to the strategies since the last settle
+        total = round(sum(executed[-1] for executed in self.executed), 2)
+        self.executed = []
+        self.cash -= total
+        return total
+
 class CapitalAllocator:
     def __init__(self, context):
         self.context = context
@@ -42,6 +264,8 @@ class CapitalAllocator:
         self.min_perfs = 20
         self.incremental = True
         self.weights = {}
+        self.metrics = {}
+        self.transfers = TransferPlanner()
         
     def initialize(self):
         init_cap = self.context.portfolio.starting_cash
@@ -51,8 +275,11 @@ class CapitalAllocator:
         contexts = {s.name:get_context(s.name) for s in self.context.strategies}
         n = len(contexts)
         
-        self.changes = {k:round(init_cap/n) for k in contexts}
+        # whole amounts, the remainder spread so that the total is the cash
+        share, rest = divmod(int(self.cash), n)
+        self.changes = {k:share + (i < rest) for i, k in enumerate(contexts)}
         self.weights = {k:1/n for k in contexts}
+        self.transfers.make_plan(self.changes, self.cash)
         
         for s in self.context.strategies:
             self.allocate(s)
@@ -60,82 +287,257 @@ class CapitalAllocator:
     def compute(self):
         contexts = {s.name:get_context(s.name) for s in self.context.strategies}
         contexts = {k:v for k,v in contexts.items() if v is not None}
-            
+        
+        # a single cash pool update for the transfers of the last day
+        self.cash -= self.transfers.settle()
         self.changes = self.compute_allocation(contexts)
+        self.transfers.make_plan(self.changes, self.cash)
         
     def compute_allocation(self, contexts):
-        total_value = sum(
-                [contexts[s].portfolio.portfolio_value for s in contexts])
-        capital = total_value + self.cash
+        names = list(contexts)
+        values = np.array([contexts[k].portfolio.portfolio_value for k in names])
+        capital = values.sum() + self.cash
+        # the pending transfers are part of the strategy capital
+        pending = self.transfers.pending()
+        values = values + np.array([pending.get(k, 0) for k in names])
         record(capital=capital, cash=self.cash)
         
         n = len(contexts)
-        metrics = {}
-        weighted_metrics = 0
         
         # compute the metrics
-        for k in contexts:
-            metric = self.compute_metrics(contexts[k])
-            if metric is None:
-                continue
-            
-            metrics[k] = metric
-            weighted_metrics += metric*self.weights[k]
-            
-        if not metrics:
+        metrics = [self.compute_metrics(k, contexts[k]) for k in names]
+        active = np.array([metric is not None for metric in metrics], dtype=bool)
+        
+        if not active.any():
             # no change in allocation
             record(**{k:self.weights[k] for k in contexts})
             return {k:0 for k in contexts}
         
-        if weighted_metrics==0:
+        metrics = np.array([0 if metric is None else metric for metric in metrics],
+                           dtype=np.float64)
+        weights = np.array([self.weights[k] for k in names])
+        
+        if metrics[active] @ weights[active] == 0:
             # if all values are 0, set equal allocation
-            metrics = {k:1/n for k in contexts}
-            weighted_metrics = 1/n
+            metrics = np.full(n, 1/n)
+            active[:] = True
                 
-        # apply the exponential updates
-        total_update = 0
-        updates = {}
-        for k in metrics:
-            if self.incremental:
-                updates[k] = np.exp(self.nu*metrics[k]/weighted_metrics)*self.weights[k]
-            else:
-                updates[k] = metrics[k]
-            total_update += updates[k]
-            
-        # computes the new weights applying max and min allocation
-        weights = {}
-        total_weights = 0
-        for k in metrics:
-            weights[k] = max(self.min, min(updates[k]/total_update, self.max))
-            total_weights += weights[k]
+        # apply the exponential updates and the max and min allocation
+        weights = exponential_allocation(
+                metrics[active], weights[active], self.nu, self.min, self.max,
+                self.incremental)
         
         # compute the change in capital allocation to action
-        changes = {}
-        for k in metrics:
-            self.weights[k] = weights[k]/total_weights
-            changes[k] = self.weights[k]*capital - contexts[k].portfolio.portfolio_value
+        changes = weights*capital - values[active]
+        names = [k for k, flag in zip(names, active) if flag]
+        self.weights.update(zip(names, weights))
         
         record(**{k:self.weights[k] for k in contexts})
-        return changes
+        return dict(zip(names, changes))
     
-    def compute_metrics(self, sub_context):
-        perfs =  sub_context.pnls.iloc[-self.perfs_lookback:]
-        if len(perfs) < self.min_perfs:
+    def compute_metrics(self, name, sub_context):
+        if name not in self.metrics:
+            self.metrics[name] = RollingMetrics(self.perfs_lookback)
+        perfs = self.metrics[name].update(sub_context.pnls)
+        if perfs.count < self.min_perfs:
             return
         
         return growth(perfs)
         
     def allocate(self, strategy):
-        capital_to_add = self.changes.get(strategy.name, 0)
-        if capital_to_add == 0:
-            return
+        strategy.capital_change = self.transfers.amounts.get(strategy.name, 0)
         
-        strategy.capital_change = capital_to_add
+    def transfer(self, strategy, phase):
+        return self.transfers.execute(strategy.name, phase)
+
+def _as_list(x):
+    return list(x) if isinstance(x, (list, tuple, set)) else [x]
+
+class SharedData:
+    """
+        Coalesces the `data.history` requests of the sub-strategies within a
+        bar. Requests for the same frequency are served by slicing a single
+        fetch of the union of the assets, fields and number of bars requested
+        (or registered in advance with `register`, so that the first request
+        of a bar fetches for all). The fetch is repeated with the union only
+        if a request is not covered, and the cache is dropped when the bar
+        advances. The sub-strategies share the market data, so a fetch with
+        the `data` of any of them serves them all. Returned frames must be
+        treated as read-only.
+    """
+    def __init__(self):
+        self.requests = {}
+        self.cache = {}
+        self.dt = None
+        self.fetches = 0
+        
+    def register(self, assets, fields, nbars, frequency):
+        self.requests[frequency] = self._union(
+                self.requests.get(frequency), assets, fields, nbars)
+        
+    def _union(self, spec, assets, fields, nbars):
+        assets, fields = _as_list(assets), _as_list(fields)
+        if spec is None:
+            return assets, fields, nbars
+        
+        known_assets, known_fields, known_nbars = spec
+        assets = known_assets + [a for a in assets if a not in known_assets]
+        fields = known_fields + [f for f in fields if f not in known_fields]
+        return assets, fields, max(nbars, known_nbars)
+    
+    def _covers(self, spec, assets, fields, nbars):
+        if spec is None:
+            return False
+        known_assets, known_fields, known_nbars = spec
+        return nbars <= known_nbars and \
+            set(_as_list(fields)).issubset(known_fields) and \
+            set(_as_list(assets)).issubset(known_assets)
+    
+    def history(self, data, assets, fields, nbars, frequency):
+        dt = get_datetime()
+        if dt != self.dt:
+            self.cache = {}
+            self.dt = dt
+            
+        spec, store = self.cache.get(frequency, (None, None))
+        if not self._covers(spec, assets, fields, nbars):
+            spec = self._union(
+                    spec or self.requests.get(frequency), assets, fields, nbars)
+            store = self._fetch(data, *spec, frequency)
+            self.cache[frequency] = spec, store
+            
+        return self._slice(store, assets, fields, nbars)
+    
+    def _fetch(self, data, assets, fields, nbars, frequency):
+        # one (bars x assets) frame per field
+        self.fetches += 1
+        if len(fields) == 1:
+            return {fields[0]:data.history(assets, fields[0], nbars, frequency)}
+        
+        prices = data.history(assets, fields, nbars, frequency)
+        return {f:prices[f].unstack(level=0) for f in fields}
+    
+    def _slice(self, store, assets, fields, nbars):
+        if not isinstance(fields, (list, tuple)):
+            return store[fields][assets].iloc[-nbars:]
+        
+        if not isinstance(assets, (list, tuple)):
+            return pd.DataFrame({f:store[f][assets] for f in fields}).iloc[-nbars:]
+        
+        return pd.concat({a:pd.DataFrame(
+                {f:store[f][a] for f in fields}).iloc[-nbars:] for a in assets})
+
+class StrategyPool:
+    """
+        Computes the signals and target positions (the compute-only phase)
+        of the sub-strategies in worker processes, once per bar for all the
+        strategies that can trade. The first strategy to run in a bar fetches
+        the prices of all and sends them to the workers, each strategy is
+        assigned to a fixed worker. The strategies then read their results
+        and place their orders in their own callbacks, in the usual order.
+        Workers are forked on first use, after the strategies are initialized.
+        A strategy without results (e.g. if its prices are not available)
+        computes them itself.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.strategies = []
+        self.conns = []
+        self.procs = []
+        self.dt = None
+        self.results = {}
+        
+    def add(self, strategy):
+        self.strategies.append(strategy)
+        
+    def start(self):
+        import multiprocessing as mp
+        
+        method = 'fork' if 'fork' in mp.get_all_start_methods() else 'spawn'
+        context = mp.get_context(method)
+        n_workers = max(1, min(self.workers or os.cpu_count() or 1, len(self.strategies)))
+        for k in range(n_workers):
+            assigned = {s.name:s for s in self.strategies[k::n_workers]}
+            conn, child = context.Pipe()
+            proc = context.Process(target=_strategy_worker, args=(child, assigned),
+                                   daemon=True)
+            proc.start()
+            child.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+        atexit.register(self.close)
+        
+    def get_results(self, strategy, data):
+        dt = get_datetime()
+        if dt != self.dt:
+            self.dt = dt
+            self.results = self.compute(data)
+        return self.results.pop(strategy.name, None)
+    
+    def compute(self, data):
+        if not self.procs:
+            self.start()
+            
+        n_workers = len(self.conns)
+        tasks = [{} for _ in range(n_workers)]
+        for k, s in enumerate(self.strategies):
+            if not s.can_trade:
+                continue
+            prices = s.fetch_prices(data)
+            if prices is not None:
+                tasks[k % n_workers][s.name] = prices
+        
+        for conn, task in zip(self.conns, tasks):
+            conn.send(task)
+            
+        results = {}
+        errors = []
+        for conn in self.conns:
+            computed = conn.recv()
+            if isinstance(computed, Exception):
+                errors.append(computed)
+                continue
+            results.update(computed)
+        if errors:
+            raise errors[0]
+        return results
+    
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for proc in self.procs:
+            proc.join(timeout=5)
+        self.conns, self.procs = [], []
+        atexit.unregister(self.close)
+        
+def _strategy_worker(conn, strategies):
+    # worker loop, computes the signals and targets of the strategies
+    # for the prices received, until it receives None
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        
+        try:
+            results = {}
+            for name, prices in task.items():
+                signals = strategies[name].compute_signals(prices)
+                results[name] = signals, strategies[name].compute_targets(signals)
+        except Exception as e:
+            results = e
+        conn.send(results)
 
 class AdvisorStrategy(Strategy):
-    def __init__(self, name, advisor, allocator):
+    def __init__(self, name, advisor, allocator, shared_data=None, pool=None):
         self.advisor = advisor
         self.allocator = allocator
+        self.shared_data = shared_data if shared_data is not None else SharedData()
+        self.pool = pool
+        if self.pool is not None:
+            self.pool.add(self)
         self.can_trade = False
         self.target_position = {}
         self.signals = {}
@@ -146,14 +548,15 @@ class AdvisorStrategy(Strategy):
         set_commission(commission.PerShare(cost=0.0, min_trade_cost=0.0))
         set_slippage(slippage.FixedSlippage(0.00))
         self.securities = [symbol('RELIANCE', product_type='margin'),symbol('INFY', product_type='margin')]
+        self.shared_data.register(self.securities, 'close', 375, '1m')
         
         schedule_function(self.release_capital, date_rules.everyday(), time_rules.at('09:15'))
         schedule_function(self.start_trading, date_rules.everyday(), time_rules.at('09:30'))
         schedule_function(self.run_strategy, date_rules.everyday(), time_rules.every_nth_minute(5))
+        schedule_function(self.fund_capital, date_rules.everyday(), time_rules.at('09:35'))
         schedule_function(self.stop_trading, date_rules.everyday(), time_rules.at('15:00'))
         
-        transferred = fund_transfer(self.capital_change)
-        self.allocator.cash -= round(transferred, 2)
+        self.allocator.transfer(self, TransferPlanner.OPEN)
         self.capital_change = 0
         
     def before_trading_start(self, context, data):
@@ -162,10 +565,7 @@ class AdvisorStrategy(Strategy):
         self.target_position = {}
         self.signals = {}
         
-        if self.capital_change > 0:
-            transferred = fund_transfer(self.capital_change)
-            self.allocator.cash -= round(transferred, 2)
-            self.capital_change = 0
+        self.allocator.transfer(self, TransferPlanner.OPEN)
             
     def release_capital(self, context, data):
         if self.capital_change < 0:
@@ -179,8 +579,17 @@ class AdvisorStrategy(Strategy):
 
     def run_strategy(self, context, data):
         if self.can_trade:
-            self.generate_signals(context, data)
-            self.generate_target_position(context, data)
+            results = None
+            if self.pool is not None:
+                results = self.pool.get_results(self, data)
+            
+            if results is None:
+                self.generate_signals(context, data)
+                self.generate_target_position(context, data)
+            else:
+                signals, targets = results
+                self.update_signals(signals)
+                self.update_targets(targets)
             self.rebalance(context, data)
         
     def rebalance(self, context,data):
@@ -190,35 +599,60 @@ class AdvisorStrategy(Strategy):
                     security, self.target_position[security])
             
     def generate_target_position(self, context, data):
+        signals = [self.signals[security] for security in self.securities]
+        self.update_targets(self.compute_targets(signals))
+        
+    def compute_targets(self, signals):
+        # target positions by security index, none for signal 999
         weight = self.get_weight()
+        targets = {}
     
-        for security in self.securities:
-            if self.signals[security] == 999:
+        for i, signal in enumerate(signals):
+            if signal == 999:
                 continue
-            elif self.signals[security] > 0.5:
-                self.target_position[security] = weight
-            elif self.signals[security] < -0.5:
-                self.target_position[security] = -weight
+            elif signal > 0.5:
+                targets[i] = weight
+            elif signal < -0.5:
+                targets[i] = -weight
             else:
-                self.target_position[security] = 0
+                targets[i] = 0
+        return targets
+    
+    def update_targets(self, targets):
+        for i, target in targets.items():
+            self.target_position[self.securities[i]] = target
                 
     def generate_signals(self, context, data):
+        prices = self.fetch_prices(data)
+        if prices is None:
+            return
+        
+        self.update_signals(self.compute_signals(prices))
+        
+    def fetch_prices(self, data):
+        # the prices as a (securities x bars) array
         try:
-            price_data = data.history(self.securities, 'close', 375, '1m')
+            price_data = self.shared_data.history(
+                    data, self.securities, 'close', 375, '1m')
         except:
             return
+        
+        return np.array([price_data.loc[:,security].values \
+                         for security in self.securities])
+        
+    def compute_signals(self, prices):
+        return [self.advisor(px) for px in prices]
     
-        for security in self.securities:
-            px = price_data.loc[:,security].values
-            self.signals[security] = self.advisor(px)
+    def update_signals(self, signals):
+        self.signals.update(zip(self.securities, signals))
             
     def start_trading(self, context, data):
         self.can_trade = True
+        self.allocator.transfer(self, TransferPlanner.RELEASE)
         
-        if self.capital_change != 0:
-            transferred = fund_transfer(self.capital_change)
-            self.allocator.cash -= round(transferred, 2)
-        
+    def fund_capital(self, context, data):
+        # additions funded by the releases of the day
+        self.allocator.transfer(self, TransferPlanner.FUND)
         self.capital_change = 0
     
     def stop_trading(self, context, data):
@@ -269,10 +703,17 @@ def advisor_ma(px):
 
 def initialize(context):
     context.allocator = CapitalAllocator(context)
+    # the strategies trade the same securities, fetch their prices once per bar
+    context.shared_data = SharedData()
+    # set to StrategyPool(workers) to compute the strategies in parallel
+    context.pool = None
     context.strategies = [
-            AdvisorStrategy('bbands', advisor_bbands, context.allocator),
-            AdvisorStrategy('rsi', advisor_rsi, context.allocator),
-            AdvisorStrategy('xma', advisor_ma, context.allocator),
+            AdvisorStrategy('bbands', advisor_bbands, context.allocator,
+                            context.shared_data, context.pool),
+            AdvisorStrategy('rsi', advisor_rsi, context.allocator,
+                            context.shared_data, context.pool),
+            AdvisorStrategy('xma', advisor_ma, context.allocator,
+                            context.shared_data, context.pool),
             ]
     
     for s in context.strategies:
@@ -284,3 +725,8 @@ def initialize(context):
     
 def before_trading_start(context, data):
     context.allocator.compute()
+
+def analyze(context, perf):
+    # stop the strategy workers, if any
+    if context.pool is not None:
+        context.pool.close()
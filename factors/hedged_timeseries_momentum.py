@@ -6,6 +6,8 @@
     Asset class: Equities, Futures, ETFs, Currencies
     Dataset: US Equities or NSE
 """
+import numpy as np
+
 from blueshift.library.pipelines import average_volume_filter, period_returns, technical_factor
 from blueshift.library.technicals.indicators import volatility
 
@@ -21,12 +23,20 @@ def filter_assets(func=None):
     if func is None:
         func = lambda asset:True
 
+    cache = {'seen':np.array([], dtype=np.int64), 
+             'members':np.array([], dtype=np.int64)}
+
     class FilteredUniverse(CustomFilter):
         inputs = ()
         window_length = 1
         def compute(self,today,assets,out):
-            in_universe = [func(sid(asset)) for asset in assets]
-            out[:] = in_universe
+            # look up only the sids not seen so far, then mask in one go
+            new = np.setdiff1d(assets, cache['seen'])
+            if len(new):
+                selected = np.array([bool(func(sid(asset))) for asset in new])
+                cache['seen'] = np.union1d(cache['seen'], new)
+                cache['members'] = np.union1d(cache['members'], new[selected])
+            out[:] = np.isin(assets, cache['members'])
     
     return FilteredUniverse()
 
@@ -7,6 +7,8 @@
     Asset class: Equities, Futures, ETFs, Currencies
     Dataset: US Equities
 """
+import numpy as np
+
 from blueshift.library.pipelines import technical_factor
 from blueshift.library.technicals.indicators import volatility
 
@@ -17,13 +19,21 @@ from blueshift.api import schedule_function, date_rules, time_rules
 from blueshift.api import attach_pipeline, pipeline_output
 
 def filter_universe(universe):
-    universe = [asset.symbol for asset in universe]
+    universe = frozenset([asset.symbol for asset in universe])
+    cache = {'seen':np.array([], dtype=np.int64), 
+             'members':np.array([], dtype=np.int64)}
     class FilteredUniverse(CustomFilter):
         inputs = ()
         window_length = 1
         def compute(self,today,assets,out):
-            in_universe = [sid(asset).symbol in universe for asset in assets]
-            out[:] = in_universe
+            # look up only the sids not seen so far, then mask in one go
+            new = np.setdiff1d(assets, cache['seen'])
+            if len(new):
+                selected = np.array(
+                        [sid(asset).symbol in universe for asset in new])
+                cache['seen'] = np.union1d(cache['seen'], new)
+                cache['members'] = np.union1d(cache['members'], new[selected])
+            out[:] = np.isin(assets, cache['members'])
     return FilteredUniverse()
 
 def initialize(context):
@@ -14,6 +14,7 @@
     Minimum Capital: 300,000
 """
 import talib as ta
+import numpy as np
 
 from blueshift.finance import commission, slippage
 from blueshift.api import(  symbol,
@@ -142,15 +143,21 @@ def initialize(context):
     context.capital_checked = False
     context.mock = True
     
+def fibonacci_levels(px):
+    """ Fibonacci levels of the range of each row of a (assets x bars)
+        array, as a (assets x 6) array. """
+    low, high = np.min(px, axis=1), np.max(px, axis=1)
+    ratios = np.array([0,0.236,0.382,0.5,0.618,1])
+    return low[:,None] + ratios*(high - low)[:,None]
+
 def generate_supports(context, data):
-    cols = ['close']
     lookback = context.params['daily_lookback']
-    ohlc = data.history(context.universe, cols, lookback, '1d')
+    prices = data.history(context.universe, 'close', lookback, '1d')
+    px = prices[context.universe].values.T
+    levels = fibonacci_levels(px)
     
-    for asset in context.universe:
-        px = ohlc.xs(asset).close
-        context.supports[asset] = [min(px) + l*(max(px) - min(px)) \
-                          for l in [0,0.236,0.382,0.5,0.618,1]]
+    for asset, asset_levels in zip(context.universe, levels):
+        context.supports[asset] = asset_levels
     
 def before_trading_start(context, data):
     if not context.capital_checked:
@@ -0,0 +1,407 @@
+"""
+On-disk cache of pipeline outputs, keyed by pipeline term fingerprints
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import types
+import functools
+
+import numpy as np
+import pandas as pd
+
+_PRIMITIVES = (type(None), bool, int, float, complex, str, bytes)
+_HEAPTYPE = 1 << 9
+
+class _Undescribable(Exception):
+    """ raised for objects that cannot be fingerprinted reliably. """
+    pass
+
+def _describe(obj, path=()):
+    """
+        a stable (across runs) string description of an object, used
+        for fingerprinting. Terms built by the `custom.py` builders are
+        described by the builder, with the source of its module, and its
+        arguments. Other functions
+        and classes are described by their code, defaults, closure and
+        referenced globals, so that parameters like lookback, offset or
+        amount are captured. Raises `_Undescribable` for objects whose
+        state cannot be inspected.
+    """
+    if isinstance(obj, _PRIMITIVES):
+        return repr(obj)
+    if isinstance(obj, np.generic):
+        return repr(obj.item())
+    if isinstance(obj, np.ndarray):
+        digest = hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        return f'array({obj.dtype},{obj.shape},{digest})'
+    if isinstance(obj, types.ModuleType):
+        return f'module({obj.__name__})'
+    for i, parent in enumerate(path):
+        if parent is obj:
+            # a reference back to an object being described
+            return f'ref({i})'
+
+    path = path + (obj,)
+    describe = lambda x:_describe(x, path)
+
+    builder = getattr(obj, '_builder', None)
+    if isinstance(builder, tuple):
+        builder, arguments = builder
+        return f'term({_describe_builder(builder, path)},{describe(arguments)})'
+    if isinstance(obj, (list, tuple)):
+        return '(' + ','.join(describe(x) for x in obj) + ')'
+    if isinstance(obj, (set, frozenset)):
+        return '{' + ','.join(sorted(describe(x) for x in obj)) + '}'
+    if isinstance(obj, dict):
+        items = sorted(f'{describe(k)}:{describe(v)}' for k,v in obj.items())
+        return '{' + ','.join(items) + '}'
+    if isinstance(obj, (pd.Series, pd.DataFrame, pd.Index)):
+        hashes = pd.util.hash_pandas_object(obj, index=True).values
+        digest = hashlib.sha1(hashes.tobytes()).hexdigest()
+        labels = obj.columns if isinstance(obj, pd.DataFrame) else [obj.name]
+        return f'{type(obj).__name__}({describe(list(labels))},{digest})'
+    if isinstance(getattr(obj, 'sid', None), (int, np.integer)):
+        # an asset
+        return f'asset({int(obj.sid)})'
+    if isinstance(obj, types.CodeType):
+        consts = ','.join(describe(c) for c in obj.co_consts)
+        return f'code({obj.co_code.hex()},{consts},{obj.co_names})'
+    if isinstance(obj, functools.partial):
+        return f'partial({describe(obj.func)},{describe(obj.args)},' + \
+            f'{describe(obj.keywords)})'
+    if isinstance(obj, types.MethodType):
+        return f'method({describe(obj.__self__)},{describe(obj.__func__)})'
+    if isinstance(obj, types.FunctionType):
+        closure = [cell.cell_contents if _has_contents(cell) else None \
+                   for cell in (obj.__closure__ or ())]
+        return f'function({obj.__module__}.{obj.__qualname__},' + \
+            f'{describe(obj.__code__)},{describe(obj.__defaults__)},' + \
+            f'{describe(obj.__kwdefaults__)},{describe(closure)},' + \
+            f'{describe(_globals(obj))})'
+    if isinstance(obj, type):
+        name = f'{obj.__module__}.{obj.__qualname__}'
+        if '<locals>' not in obj.__qualname__:
+            return f'class({name})'
+        # dynamically created class, describe its body
+        body = {k:v for k,v in vars(obj).items() if not k.startswith('__')}
+        return f'class({name},{describe(obj.__bases__)},{describe(body)})'
+    slots = [slot for cls in type(obj).__mro__ \
+             for slot in cls.__dict__.get('__slots__', ()) \
+             if slot not in ('__dict__', '__weakref__')]
+    if not type(obj).__flags__ & _HEAPTYPE or \
+        not (hasattr(obj, '__dict__') or slots):
+        # builtins, ufuncs and other compiled callables, by name
+        name = getattr(obj, '__qualname__', getattr(obj, '__name__', None))
+        owner = getattr(obj, '__self__', None)
+        if not callable(obj) or name is None or not \
+            (owner is None or isinstance(owner, types.ModuleType)):
+            raise _Undescribable(type(obj).__qualname__)
+        return f'callable({getattr(obj, "__module__", "")}.{name})'
+
+    state = dict(getattr(obj, '__dict__', {}))
+    for slot in slots:
+        if hasattr(obj, slot):
+            state[slot] = getattr(obj, slot)
+    return f'{describe(type(obj))}{describe(state)}'
+
+_SOURCE_DIGESTS = {}
+
+def _source_digest(filename):
+    """ digest of a source file, cached on its modification time. """
+    stat = os.stat(filename)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _SOURCE_DIGESTS.get(filename)
+    if cached is None or cached[0] != version:
+        with open(filename, 'rb') as fp:
+            digest = hashlib.sha1(fp.read()).hexdigest()
+        cached = _SOURCE_DIGESTS[filename] = (version, digest)
+    return cached[1]
+
+def _describe_builder(builder, path):
+    """
+        a term builder, by name and the source of its module, which 
+        covers the term classes and the kernels the builder uses. If the 
+        source is not available, by the builder code.
+    """
+    name = f'{builder.__module__}.{builder.__qualname__}'
+    try:
+        return f'builder({name},{_source_digest(builder.__code__.co_filename)})'
+    except OSError:
+        return f'builder({name},{_describe(builder, path)})'
+
+def _has_contents(cell):
+    try:
+        cell.cell_contents
+    except ValueError:
+        return False
+    return True
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+def _globals(func):
+    """ the module globals a function (or its nested code) refers to. """
+    names = _code_names(func.__code__)
+    return {name:value for name, value in func.__globals__.items() \
+            if name in names}
+
+def fingerprint(term):
+    """
+        Returns a fingerprint (hex digest) of a pipeline term, from the
+        builder that created it (with its source) and its arguments, or
+        else from its class, inputs, window length, mask and the 
+        parameters captured by the factory function that created it. Returns None if the
+        term cannot be described, such a term must not be cached.
+    """
+    try:
+        description = _describe(term)
+    except (_Undescribable, RecursionError):
+        return None
+    return hashlib.sha1(description.encode()).hexdigest()
+
+class _TermStore():
+    """
+        Append-only columnar store for the per-date output of a single
+        term. It has three files - `values.bin` and `sids.bin` with the
+        output values and asset sids for all dates, and `index.bin` with
+        (date, offset, count) records pointing into them. Values are
+        read through a memory map.
+    """
+    def __init__(self, path, dtype=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta = os.path.join(path, 'meta.json')
+        if os.path.exists(meta):
+            with open(meta) as fp:
+                dtype = json.load(fp)['dtype']
+        elif dtype is not None:
+            with open(meta, 'w') as fp:
+                json.dump({'dtype':np.dtype(dtype).str}, fp)
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+
+        index = self._file('index.bin')
+        records = np.fromfile(index, dtype=np.int64) \
+            if os.path.exists(index) else np.empty(0, dtype=np.int64)
+        records = records[:3*(len(records)//3)].reshape(-1, 3)
+        self.index = {int(d):(int(o), int(n)) for d,o,n in records}
+        self.size = int(records[:,1:].sum(axis=1).max()) \
+            if len(records) else 0
+        self._values = self._sids = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _mmap(self):
+        if self._values is None or len(self._values) < self.size:
+            self._values = np.memmap(
+                    self._file('values.bin'), dtype=self.dtype, mode='r')
+            self._sids = np.memmap(
+                    self._file('sids.bin'), dtype=np.int64, mode='r')
+        return self._sids, self._values
+
+    def touch(self):
+        with open(self._file('access'), 'w'):
+            pass
+
+    def __contains__(self, date):
+        return date in self.index
+
+    def get(self, date):
+        """ returns (sids, values) for the date, or None. """
+        if date not in self.index:
+            return
+        offset, count = self.index[date]
+        if count == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=self.dtype)
+        sids, values = self._mmap()
+        return sids[offset:offset+count], values[offset:offset+count]
+
+    def put(self, date, sids, values):
+        if date in self.index:
+            return
+        sids = np.asarray(sids, dtype=np.int64)
+        values = np.asarray(values, dtype=self.dtype)
+
+        # data first, the index record last, so that an interrupted
+        # write is never referenced
+        with open(self._file('values.bin'), 'ab') as fp:
+            fp.seek(0, os.SEEK_END)
+            offset = fp.tell()//self.dtype.itemsize
+            fp.write(values.tobytes())
+        with open(self._file('sids.bin'), 'ab') as fp:
+            fp.seek(offset*8)
+            fp.truncate()
+            fp.write(sids.tobytes())
+        with open(self._file('index.bin'), 'ab') as fp:
+            fp.write(np.array([date, offset, len(sids)],
+                              dtype=np.int64).tobytes())
+
+        self.index[date] = (offset, len(sids))
+        self.size = max(self.size, offset + len(sids))
+
+class PipelineCache():
+    """
+       A persistent cache in front of `pipeline_output`. The outputs of
+       each pipeline column (and the screen) are stored per date on disk,
+       keyed by the fingerprint of the term, so that re-runs of a
+       backtest (e.g. to tune parameters not affecting the pipeline) read
+       from the cache instead of computing the pipeline again.
+
+       Args:
+           `context (obj)`: the algo context.
+           `root (str)`: the cache directory.
+           `max_bytes (int)`: cache size budget, least recently used
+           terms are evicted beyond this.
+           `namespace (str)`: an extra key, e.g. the dataset name.
+
+       Note:
+           The cache does not know about changes to the underlying
+           data, use a different `namespace` (or clear the cache) if
+           the data changes. Only numeric and boolean columns are
+           cached, else the pipeline is computed as usual. Assets are
+           stored by sid and restored through the `sid` API function.
+
+       .. code-block:: python
+
+           # from blueshift.library.pipelines.cache import PipelineCache
+
+           def initialize(context):
+               context.cache = PipelineCache(context, 'pipeline_cache')
+               context.cache.attach_pipeline(
+                       make_strategy_pipeline(context), 'strategy_pipeline')
+
+           def generate_signals(context, data):
+               results = context.cache.pipeline_output('strategy_pipeline')
+    """
+    def __init__(self, context, root, max_bytes=2**30, namespace=''):
+        if not context:
+            msg = 'Missing context, pass a valid context as keyword argument.'
+            raise ValueError(msg)
+
+        self.sid_fn = context.get_algo().sid
+        self.root = root
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.pipelines = {}
+        self.stores = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _key(self, *parts):
+        key = '|'.join([self.namespace, *parts])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def attach_pipeline(self, pipeline, name):
+        """ 
+            attach the pipeline and compute the term fingerprints. If any 
+            term cannot be fingerprinted, the pipeline is attached without 
+            caching.
+        """
+        from blueshift.api import attach_pipeline
+
+        screen = pipeline.screen
+        keys = {col:fingerprint(term) for col, term \
+                in pipeline.columns.items()}
+        screen_key = fingerprint(screen) if screen is not None else ''
+        
+        if screen_key is None or None in keys.values():
+            self.pipelines.pop(name, None)
+            return attach_pipeline(pipeline, name=name)
+        
+        screen_key = self._key('screen', screen_key)
+        columns = {col:self._key('column', screen_key, key) \
+                   for col, key in keys.items()}
+        self.pipelines[name] = (screen_key, columns)
+        return attach_pipeline(pipeline, name=name)
+
+    def _store(self, key, dtype=None):
+        store = self.stores.get(key)
+        if store is None or not os.path.exists(store.path):
+            path = os.path.join(self.root, key)
+            if dtype is None and not os.path.exists(path):
+                return
+            store = self.stores[key] = _TermStore(path, dtype)
+        return store
+
+    def pipeline_output(self, name):
+        """ returns the pipeline output, from the cache if available. """
+        from blueshift.api import get_datetime, pipeline_output
+
+        if name not in self.pipelines:
+            # not attached through the cache
+            return pipeline_output(name)
+
+        screen_key, columns = self.pipelines[name]
+        date = int(pd.Timestamp(get_datetime()).normalize().value)
+
+        cached = self._read(date, screen_key, columns)
+        if cached is not None:
+            return cached
+
+        results = pipeline_output(name)
+        self._write(date, screen_key, columns, results)
+        return results
+
+    def _read(self, date, screen_key, columns):
+        stores = [self._store(key) for key in [screen_key, *columns.values()]]
+        if any(store is None or date not in store for store in stores):
+            return
+
+        sids = stores[0].get(date)[0]
+        data = {}
+        for col, store in zip(columns, stores[1:]):
+            col_sids, values = store.get(date)
+            if not np.array_equal(col_sids, sids):
+                return
+            data[col] = np.array(values)
+
+        for store in stores:
+            store.touch()
+        assets = [self.sid_fn(int(sid)) for sid in sids]
+        return pd.DataFrame(data, index=assets, columns=list(columns))
+
+    def _write(self, date, screen_key, columns, results):
+        for col in columns:
+            if results[col].dtype.kind not in 'biuf':
+                return
+
+        sids = np.array([asset.sid for asset in results.index], dtype=np.int64)
+        for col, key in columns.items():
+            store = self._store(key, results[col].dtype)
+            store.put(date, sids, results[col].values)
+            store.touch()
+        store = self._store(screen_key, np.bool_)
+        store.put(date, sids, np.ones(len(sids), dtype=np.bool_))
+        store.touch()
+        self.evict()
+
+    def evict(self):
+        """ remove least recently used terms beyond the size budget. """
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            access = os.path.join(entry.path, 'access')
+            atime = os.path.getmtime(access) if os.path.exists(access) else 0
+            entries.append((atime, size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            self.stores = {k:v for k,v in self.stores.items() if v.path != path}
+            total -= size
+
+    def clear(self):
+        """ remove all cached data. """
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+        self.stores = {}
@@ -3,7 +3,11 @@ Custom pipeline filters and factors examples
 """
 
 import numpy as np
+import pandas as pd
 import warnings
+import inspect
+import functools
+import contextlib
 
 try:
     from blueshift.data.pipeline.data import EquityPricing
@@ -11,7 +15,99 @@ try:
     from blueshift.pipeline.factors import AverageDollarVolume
 except ImportError:
     raise ValueError('pipeline is not supported on this version of blueshift.')
+
+# terms built in the current `shared_terms` block, keyed by the builder 
+# and its arguments. None outside such a block.
+_TERMS = None
+
+@contextlib.contextmanager
+def shared_terms():
+    """
+       Share identical terms within a pipeline construction. Inside the 
+       block, builder calls with the same arguments return the same term 
+       object, so the pipeline computes a shared term only once, even if 
+       it is used in the screen as well as in the columns. The terms are 
+       dropped at the end of the block, so they are never shared across 
+       pipelines or runs. Terms that keep state across days (incremental 
+       volume averages and the asset filters) are not shared.
+       
+       .. code-block:: python
+           
+           # from blueshift.library.pipelines import shared_terms
+           
+           def make_strategy_pipeline(context):
+               with shared_terms():
+                   pipe = Pipeline()
+                   pipe.set_screen(average_volume_filter(200, 1E7))
+                   pipe.add(average_volume_factor(200, 0), 'liquidity')
+               return pipe
+    """
+    global _TERMS
+    outer = _TERMS
+    if outer is None:
+        _TERMS = {}
+    try:
+        yield
+    finally:
+        _TERMS = outer
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_hashable(v) for v in value)
+    return value
+
+def _canonical(*ignore, shared=True):
+    """
+        Memoize a term builder on its arguments (except the ones in 
+        `ignore`) within a `shared_terms` block. Outside a block every 
+        call builds a new term. The built term records the builder 
+        function and its arguments (except `context` and `ignore`) as 
+        `_builder`, for fingerprinting in the pipeline cache. Only stateless terms 
+        are shared: `shared` is False for builders of terms that keep 
+        state across calls, or a function of the arguments that tells 
+        if the term is stateless.
+    """
+    skip = set(ignore) | {'context'}
     
+    def decorator(builder):
+        signature = inspect.signature(builder)
+        
+        def build(arguments, args, kwargs):
+            term = builder(*args, **kwargs)
+            try:
+                term._builder = (builder, arguments)
+            except AttributeError:
+                pass
+            return term
+        
+        @functools.wraps(builder)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {name:value for name, value \
+                         in bound.arguments.items() if name not in skip}
+            stateless = shared(arguments) if callable(shared) else shared
+            if _TERMS is None or not stateless:
+                return build(arguments, args, kwargs)
+            
+            key = (builder.__name__,) + tuple(
+                    (name, _hashable(value)) for name, value \
+                    in bound.arguments.items() if name not in ignore)
+            try:
+                term = _TERMS.get(key)
+            except TypeError:
+                # unhashable arguments, cannot share
+                return build(arguments, args, kwargs)
+            if term is None:
+                term = _TERMS[key] = build(arguments, args, kwargs)
+            return term
+        
+        return wrapper
+    return decorator
+    
+@_canonical('context')
 def select_universe(lookback, size, context=None):
     """
        Returns a custom filter object for volume-based filtering.
@@ -33,17 +129,31 @@ def select_universe(lookback, size, context=None):
     """
     return AverageDollarVolume(window_length=lookback).top(size)
 
-def average_volume_filter(lookback, amount, context=None):
+def _stateless_volume(arguments):
+    # incremental terms keep running sums, and are never shared
+    return not arguments['incremental']
+
+@_canonical('context', shared=_stateless_volume)
+def average_volume_filter(lookback, amount, incremental=False, context=None):
     """
        Returns a custom filter object for volume-based filtering.
        
        Args:
            `lookback (int)`: lookback window size
            `amount (int)`: amount to filter (high-pass)
+           `incremental (bool)`: update the average with running sums
            
        Returns:
            A custom filter object
            
+       Note:
+           If `incremental` is True, the filter keeps running sums of 
+           dollar volume per asset and updates them by one bar on 
+           consecutive pipeline days, instead of re-computing the 
+           average over the whole window. It falls back to a full 
+           computation if the assets or the window data do not line 
+           up with the previous call.
+           
        .. code-block:: python
            
            # from blueshift.library.pipelines.pipelines import average_volume_filter
@@ -53,28 +163,27 @@ def average_volume_filter(lookback, amount, context=None):
            volume_filter = average_volume_filter(200, 1000000)
            pipe.set_screen(volume_filter)
     """
-    class AvgDailyDollarVolumeTraded(CustomFilter):
-        inputs = [EquityPricing.close, EquityPricing.volume]
-        def compute(self,today,assets,out,close_price,volume):
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", category=RuntimeWarning)
-                dollar_volume = np.nanmean(close_price * volume, axis=0)
-            high_volume = dollar_volume > amount
-            out[:] = high_volume
-    
-    return AvgDailyDollarVolumeTraded(window_length = lookback)
+    # built on the (shared) factor, so that a pipeline using both the 
+    # filter and the factor computes the average only once
+    return average_volume_factor(lookback, amount, incremental) > amount
 
-def average_volume_factor(lookback, amount, context=None):
+@_canonical('context', 'amount', shared=_stateless_volume)
+def average_volume_factor(lookback, amount, incremental=False, context=None):
     """
        Returns a custom factor object for volume-based filtering.
        
        Args:
            `lookback (int)`: lookback window size
            `amount (int)`: amount to filter (high-pass)
+           `incremental (bool)`: update the average with running sums
            
        Returns:
            A custom factor object
            
+       Note:
+           See `average_volume_filter` for `incremental` computation. 
+           The `amount` is not used for the factor itself.
+           
        .. code-block:: python
            
            # from blueshift.library.pipelines.pipelines import average_volume_filter
@@ -84,16 +193,23 @@ def average_volume_factor(lookback, amount, context=None):
            volume_factor = average_volume_factor(200, 1000000)
            pipe.add(average_volume_factor, 'volume')
     """
+    rolling = _RollingDollarVolume(lookback) if incremental else None
+    
     class AvgDailyDollarVolumeTraded(CustomFactor):
         inputs = [EquityPricing.close, EquityPricing.volume]
         def compute(self,today,assets,out,close_price,volume):
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", category=RuntimeWarning)
-                dollar_volume = np.nanmean(close_price * volume, axis=0)
+            if rolling:
+                dollar_volume = rolling.update(
+                        today, assets, close_price, volume)
+            else:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", category=RuntimeWarning)
+                    dollar_volume = np.nanmean(close_price * volume, axis=0)
             out[:] = dollar_volume
     
     return AvgDailyDollarVolumeTraded(window_length = lookback)
 
+@_canonical(shared=False)
 def filter_assets(func=None, context=None):
     """
        Returns a custom filter object to filter assets based on a user 
@@ -128,17 +244,20 @@ def filter_assets(func=None, context=None):
     if func is None:
         func = lambda asset:True
 
+    # we do a symbol(sid().symbol) here as sid may not be same 
+    # between the pipeline store and the active store
+    membership = _AssetMembership(
+            lambda asset:func(symbol_fn(sid_fn(asset).symbol)))
+
     class FilteredUniverse(CustomFilter):
         inputs = ()
         window_length = 1
         def compute(self,today,assets,out):
-            # we do a symbol(sid().symbol) here as sid may not be same 
-            # between the pipeline store and the active store
-            in_universe = [func(symbol_fn(sid_fn(asset).symbol)) for asset in assets]
-            out[:] = in_universe
+            out[:] = membership(assets)
     
     return FilteredUniverse()
 
+@_canonical(shared=False)
 def filter_universe(universe, context=None):
     """
        Returns a custom filter object to filter based on a user 
@@ -171,17 +290,20 @@ def filter_universe(universe, context=None):
     sid_fn = context.get_algo().sid
     
     universe = frozenset([asset.exchange_ticker for asset in universe])
+    # we do a sid().symbol here as sid may not be same between
+    # the pipeline store and the active store
+    membership = _AssetMembership(
+            lambda asset:sid_fn(asset).exchange_ticker in universe)
+    
     class FilteredUniverse(CustomFilter):
         inputs = ()
         window_length = 1
         def compute(self,today,assets,out):
-            # we do a sid().symbol here as sid may not be same between
-            # the pipeline store and the active store
-            in_universe = [sid_fn(asset).exchange_ticker in universe for asset in assets]
-            out[:] = in_universe
+            out[:] = membership(assets)
     
     return FilteredUniverse()
 
+@_canonical(shared=False)
 def exclude_assets(universe, context=None):
     """
        Returns a custom filter object to filter based on a user 
@@ -212,19 +334,22 @@ def exclude_assets(universe, context=None):
     sid_fn = context.get_algo().sid
     
     universe = frozenset([asset.exchange_ticker for asset in universe])
+    # we do a sid here as sid().symbol may not be same between
+    # the pipeline store and the active store
+    membership = _AssetMembership(
+            lambda asset:sid_fn(asset).exchange_ticker not in universe)
+    
     class FilteredUniverse(CustomFilter):
         inputs = ()
         window_length = 1
  
         def compute(self,today,assets,out):
-            # we do a sid here as sid().symbol may not be same between
-            # the pipeline store and the active store
-            in_universe = [sid_fn(asset).exchange_ticker not in universe for asset in assets]
-            out[:] = in_universe
+            out[:] = membership(assets)
  
     return FilteredUniverse()
 
-def returns_factor(lookback, offset=0, context=None):
+@_canonical('context')
+def returns_factor(lookback, offset=0, mask=None, context=None):
     """
        Returns a custom factor object for computing simple returns over
        a period (`lookback`).
@@ -232,6 +357,7 @@ def returns_factor(lookback, offset=0, context=None):
        Args:
            `lookback (int)`: lookback window size
            `offset (int)`: offset from the end of the window
+           `mask (CustomFilter)`: compute only for assets passing the mask
            
        Returns:
            A custom factor object.
@@ -256,7 +382,7 @@ def returns_factor(lookback, offset=0, context=None):
             returns = end_price/start_price - 1
             out[:] = returns
     
-    return SignalPeriodReturns(window_length = lookback)
+    return SignalPeriodReturns(window_length = lookback, mask=mask)
 
 def filtered_returns_factor(lookback, filter_, offset=0, context=None):
     """
@@ -282,19 +408,11 @@ def filtered_returns_factor(lookback, filter_, offset=0, context=None):
            momentum = filtered_returns_factor(200,volume_filter)
            pipe.add(momentum,'momentum')
     """
-    class SignalPeriodReturns(CustomFactor):
-        inputs = [EquityPricing.close]
-        def compute(self,today,assets,out,close_price):
-            start_price = close_price[0]
-            end_price = close_price[-(1+offset)]
-            returns = end_price/start_price - 1
-            out[:] = returns
-    
-    return SignalPeriodReturns(window_length = lookback, 
-                               mask=filter_)
+    return returns_factor(lookback, offset, mask=filter_)
 
+@_canonical('context')
 def technical_factor(lookback, indicator_fn, indicator_lookback=None,
-                     context=None):
+                     mask=None, context=None):
     """
        A factory function to generate a custom factor by applying a 
        user-defined function over asset closing prices.
@@ -303,6 +421,7 @@ def technical_factor(lookback, indicator_fn, indicator_lookback=None,
            `lookback (int)`: lookback window size
            `indicator_fn (function)`: user-defined function
            `indicator_lookback (int)`: lookback for user-defined function.
+           `mask (CustomFilter)`: compute only for assets passing the mask
            
        Returns:
            A custom factor object applying the supplied function.
@@ -312,7 +431,16 @@ def technical_factor(lookback, indicator_fn, indicator_lookback=None,
            px is numpy ndarray and lookback is an n. Also the `lookback` 
            argument above must be greater than or equal to the other 
            argument `indicator_lookback`. If `None` it is set as the 
-           same value of `lookback`.
+           same value of `lookback`. The library indicators (sma, ema, 
+           rsi, roc and volatility from the technicals module) and the 
+           `batch_*` kernels here are computed for all assets in one go 
+           with a batched kernel, checked against the indicator on the 
+           first call. Other indicators (including local functions of 
+           the same name) are applied one asset at a time, unless a 
+           kernel is registered for them (see `register_batch_kernel`). 
+           Assets with no price data in the window are skipped and set 
+           to NaN. With a `mask`, the pipeline engine computes the 
+           factor only on the assets passing it.
            
        .. code-block:: python
            
@@ -326,13 +454,758 @@ def technical_factor(lookback, indicator_fn, indicator_lookback=None,
     """
     if indicator_lookback is None:
         indicator_lookback = lookback
+        
+    kernel = get_batch_kernel(indicator_fn)
+    state = {'kernel':kernel, 'checked':False}
+    
+    def signals(px):
+        if state['kernel'] is None:
+            return np.apply_along_axis(indicator_fn, 0, px, indicator_lookback)
+        
+        # batched kernel on complete columns, per-column fallback 
+        # for the rest to keep the indicator NaN semantics intact
+        complete = np.isfinite(px).all(axis=0)
+        if not state['checked'] and complete.any():
+            state['kernel'] = _validate_kernel(
+                    state['kernel'], indicator_fn, px[:,complete], 
+                    indicator_lookback)
+            state['checked'] = True
+            return signals(px)
+        
+        if complete.all():
+            return state['kernel'](px, indicator_lookback)
+        
+        values = np.empty(px.shape[1])
+        values[complete] = state['kernel'](
+                px[:,complete], indicator_lookback)
+        values[~complete] = np.apply_along_axis(
+                indicator_fn, 0, px[:,~complete], indicator_lookback)
+        return values
     
     class SignalPeriodReturns(CustomFactor):
         inputs = [EquityPricing.close]
         def compute(self,today,assets,out,close_price):
-            signals = np.apply_along_axis(
-                indicator_fn, 0, close_price, indicator_lookback)
-            out[:] = signals
+            _compute_active(signals, out, close_price)
+    
+    return SignalPeriodReturns(window_length = lookback, mask=mask)
+
+@_canonical('context')
+def multi_lookback_factor(lookback, indicator_fn, lookbacks, mask=None, 
+                          context=None):
+    """
+       A factory function to generate a custom factor computing an 
+       indicator for multiple lookbacks from the same price window, with 
+       one output per lookback (named as `<indicator name>_<lookback>`).
+       
+       Args:
+           `lookback (int)`: lookback window size
+           `indicator_fn (function)`: user-defined function
+           `lookbacks (list)`: list of lookbacks for the function.
+           `mask (CustomFilter)`: compute only for assets passing the mask
+           
+       Returns:
+           A custom factor object with one output per lookback.
+           
+       Note:
+           The `indicator_fn` must be of the form f(px, n), as in 
+           `technical_factor`. For the library `sma`, `ema`, `rsi` and 
+           `roc` (and the `batch_*` kernels of these) all lookbacks are 
+           computed together, sharing the prefix sums or the recursions. 
+           For others with a batched kernel, the kernel is applied for 
+           each lookback, else the indicator is applied one asset at a 
+           time. As in `technical_factor`, kernels are matched by the 
+           indicator function itself, not by its name.
+           
+       .. code-block:: python
+           
+           # from blueshift.library.pipelines.pipelines import multi_lookback_factor
+           # from blueshift.library.technicals.indicators import ema 
+           
+           # then inside the pipeline builder function
+           pipe = Pipeline()
+           emas = multi_lookback_factor(126, ema, [20, 50])
+           pipe.add(emas.ema_20,'ema20')
+           pipe.add(emas.ema_50,'ema50')
+    """
+    lookbacks = tuple(int(n) for n in lookbacks)
+    if not lookbacks:
+        raise ValueError('lookbacks must be a non-empty list.')
+    if max(lookbacks) > lookback:
+        msg = 'lookbacks must not be more than lookback, got '
+        msg += f'{max(lookbacks)}, {lookback}'
+        raise ValueError(msg)
+    
+    name = getattr(indicator_fn, '__name__', 'indicator')
+    names = tuple(f'{name}_{n}' for n in lookbacks)
+    if len(set(names)) < len(names):
+        raise ValueError(f'lookbacks must be unique, got {lookbacks}.')
+    
+    @functools.wraps(indicator_fn)
+    def stacked(px, lookbacks):
+        return [indicator_fn(px, n) for n in lookbacks]
+    
+    state = {'kernel':get_multi_kernel(indicator_fn), 'checked':False}
+    
+    def signals(px):
+        if state['kernel'] is None:
+            return np.apply_along_axis(stacked, 0, px, lookbacks)
+        
+        complete = np.isfinite(px).all(axis=0)
+        if not state['checked'] and complete.any():
+            state['kernel'] = _validate_kernel(
+                    state['kernel'], stacked, px[:,complete], lookbacks)
+            state['checked'] = True
+            return signals(px)
+        
+        if complete.all():
+            return state['kernel'](px, lookbacks)
+        
+        values = np.empty((len(lookbacks), px.shape[1]))
+        values[:,complete] = state['kernel'](px[:,complete], lookbacks)
+        values[:,~complete] = np.apply_along_axis(
+                stacked, 0, px[:,~complete], lookbacks)
+        return values
+    
+    class MultiLookbackFactor(CustomFactor):
+        inputs = [EquityPricing.close]
+        outputs = names
+        def compute(self,today,assets,out,close_price):
+            values = np.full((len(names), close_price.shape[1]), np.nan)
+            active = ~np.isnan(close_price).all(axis=0)
+            if active.any():
+                values[:,active] = signals(close_price[:,active])
+            for output, row in zip(names, values):
+                out[output][:] = row
+    
+    return MultiLookbackFactor(window_length = lookback, mask=mask)
+
+FUSED_OUTPUTS = ('returns', 'volatility', 'skew', 'dollar_volume')
+
+@_canonical('context')
+def fused_factor(lookback, outputs, offset=0, context=None):
+    """
+       Returns a custom factor object with multiple outputs, all 
+       computed from a single (shared) price and volume window. Each 
+       output can be added to the pipeline as a separate column.
+       
+       Args:
+           `lookback (int)`: lookback window size
+           `outputs (list)`: outputs to compute, a subset of `returns`, 
+           `volatility`, `skew` and `dollar_volume`.
+           `offset (int)`: offset from the end of the window (returns)
+           
+       Returns:
+           A custom factor object with named outputs.
+           
+       Note:
+           The `returns` output is the same as `returns_factor`, 
+           `volatility` is the standard deviation of daily returns, 
+           `skew` is the skewness of prices and `dollar_volume` is the 
+           average dollar volume, as in `average_volume_factor`, all 
+           computed over the `lookback` window.
+           
+       .. code-block:: python
+           
+           # from blueshift.library.pipelines.pipelines import fused_factor
+           
+           # then inside the pipeline builder function
+           pipe = Pipeline()
+           factors = fused_factor(252, ['returns','volatility'], 21)
+           pipe.add(factors.returns,'momentum')
+           pipe.add(factors.volatility,'vol')
+    """
+    names = tuple(outputs)
+    if not names:
+        raise ValueError(f'No outputs, must be a subset of {FUSED_OUTPUTS}')
+    unknown = [name for name in names if name not in FUSED_OUTPUTS]
+    if unknown:
+        raise ValueError(f'Unknown outputs {unknown}, must be one of {FUSED_OUTPUTS}')
+    if offset >= lookback:
+        raise ValueError(f'Offset must be less than lookback, got {offset}, {lookback}')
     
-    return SignalPeriodReturns(window_length = lookback)
+    if 'dollar_volume' in names:
+        fused_inputs = [EquityPricing.close, EquityPricing.volume]
+    else:
+        fused_inputs = [EquityPricing.close]
+        
+    class FusedFactor(CustomFactor):
+        inputs = fused_inputs
+        outputs = names
+        def compute(self,today,assets,out,close_price,volume=None):
+            if 'returns' in names:
+                start_price = close_price[0]
+                end_price = close_price[-(1+offset)]
+                out.returns[:] = end_price/start_price - 1
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                if 'volatility' in names:
+                    out.volatility[:] = batch_volatility(close_price)
+                if 'skew' in names:
+                    out.skew[:] = batch_skew(close_price)
+                if 'dollar_volume' in names:
+                    out.dollar_volume[:] = np.nanmean(
+                            close_price * volume, axis=0)
+    
+    return FusedFactor(window_length = lookback)
 
+def precomputed_factor(lookback, kind, close, volume=None, offset=0,
+                       indicator_lookback=None, context=None):
+    """
+       Returns a custom factor object that serves values from a panel 
+       precomputed once over the entire price history, instead of 
+       computing on a fresh window every day.
+       
+       Args:
+           `lookback (int)`: lookback window size
+           `kind (str or function)`: one of `returns`, `dollar_volume`, 
+           `volatility` or `roc`, or an indicator function with a 
+           registered batched kernel (see `technical_factor`).
+           `close (DataFrame)`: close prices, dates x assets (or sids)
+           `volume (DataFrame)`: volumes, required for `dollar_volume`
+           `offset (int)`: offset from the end of the window (returns)
+           `indicator_lookback (int)`: lookback for `roc` or indicator.
+           
+       Returns:
+           A custom factor object.
+           
+       Note:
+           Each row of the precomputed panel uses the bars up to its 
+           date. As with other pipeline factors, the value on a given 
+           day is from the row of the previous date, i.e. from data 
+           available before the day starts. The results match 
+           `returns_factor`, `average_volume_factor`, `fused_factor` 
+           and `technical_factor` respectively.
+           
+       .. code-block:: python
+           
+           # from blueshift.library.pipelines.pipelines import precomputed_factor
+           
+           # `close` is a dataframe of historical daily close prices
+           pipe = Pipeline()
+           momentum = precomputed_factor(252, 'returns', close, offset=21)
+           pipe.add(momentum,'momentum')
+    """
+    if indicator_lookback is None:
+        indicator_lookback = lookback
+    if kind == 'dollar_volume' and volume is None:
+        raise ValueError('volume data is required for dollar volume.')
+    if offset >= lookback:
+        raise ValueError(f'Offset must be less than lookback, got {offset}, {lookback}')
+    
+    px = close.values.astype(np.float64)
+    if kind == 'returns':
+        panel = panel_returns(px, lookback, offset)
+    elif kind == 'dollar_volume':
+        vol = volume.reindex(index=close.index, columns=close.columns)
+        panel = panel_dollar_volume(px, vol.values.astype(np.float64), lookback)
+    elif kind == 'volatility':
+        panel = panel_volatility(px, lookback)
+    elif kind == 'roc':
+        panel = panel_roc(px, indicator_lookback)
+    elif callable(kind) and get_batch_kernel(kind) is not None:
+        panel = panel_indicator(px, lookback, get_batch_kernel(kind), 
+                                indicator_lookback)
+    else:
+        raise ValueError(f'Cannot precompute {kind}.')
+    
+    dates = _naive_dates(close.index)
+    sids = np.array([getattr(asset, 'sid', asset) for asset in close.columns], 
+                    dtype=np.int64)
+    order = np.argsort(sids)
+    sids, panel = sids[order], panel[:,order]
+    
+    class PrecomputedFactor(CustomFactor):
+        inputs = ()
+        window_length = 1
+        def compute(self,today,assets,out):
+            # the last row strictly before today
+            row = np.searchsorted(dates, _naive_dates([today])[0]) - 1
+            out[:] = np.nan
+            if row < 0 or len(sids) == 0:
+                return
+            assets = np.asarray(assets, dtype=np.int64)
+            pos = np.minimum(np.searchsorted(sids, assets), len(sids)-1)
+            found = sids[pos] == assets
+            out[found] = panel[row, pos[found]]
+    
+    return PrecomputedFactor()
+
+def _compute_active(fn, out, px):
+    """
+        apply `fn` (returning one value per column) only on the columns 
+        of `px` with any data (e.g. not newly listed or delisted in the 
+        window), scatter the results back to `out` and set NaN elsewhere.
+        Masked-out assets are not passed to `compute` by the engine.
+    """
+    active = ~np.isnan(px).all(axis=0)
+    if active.all():
+        out[:] = fn(px)
+        return
+    
+    out[:] = np.nan
+    if active.any():
+        out[active] = fn(px[:,active])
+
+############################ cached asset membership #############################
+
+class _AssetMembership():
+    """
+        Caches the result of a (sid -> bool) membership function, so 
+        that it is evaluated only once for each sid. Calling it with an 
+        array of sids returns the boolean membership mask.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.seen = np.array([], dtype=np.int64)
+        self.members = np.array([], dtype=np.int64)
+
+    def __call__(self, assets):
+        assets = np.asarray(assets, dtype=np.int64)
+        new = np.setdiff1d(assets, self.seen)
+        if len(new):
+            selected = np.array(
+                    [bool(self.func(asset)) for asset in new], dtype=bool)
+            self.seen = np.union1d(self.seen, new)
+            self.members = np.union1d(self.members, new[selected])
+        return np.isin(assets, self.members)
+
+############################ incremental dollar volume ###########################
+
+class _RollingDollarVolume():
+    """
+        Keeps the running sum and count of valid dollar volume per asset 
+        over the pipeline window. On consecutive calls, where the window 
+        has moved by one bar, the oldest bar is dropped and the newest 
+        added, instead of averaging over the whole window again.
+    """
+    def __init__(self, lookback, refresh=None):
+        self.lookback = lookback
+        # full re-computation at regular interval to bound drift
+        self.refresh = refresh or lookback
+        self.today = None
+        self.assets = None
+        self.total = None
+        self.count = None
+        self.head = None
+        self.tail = None
+        self.steps = 0
+
+    def _can_roll(self, today, assets, close_price, volume):
+        if self.today is None or self.steps >= self.refresh:
+            return False
+        if len(close_price) < 2 or not today > self.today:
+            return False
+        if not np.array_equal(assets, self.assets):
+            return False
+        
+        # the window must have moved by exactly one bar with no 
+        # adjustments to the overlapping data
+        head = close_price[0]*volume[0]
+        tail = close_price[-2]*volume[-2]
+        return np.array_equal(head, self.head[1], equal_nan=True) and \
+            np.array_equal(tail, self.tail, equal_nan=True)
+
+    def reset(self, today, assets, close_price, volume):
+        dollar_volume = close_price * volume
+        valid = np.isfinite(dollar_volume)
+        self.total = np.where(valid, dollar_volume, 0).sum(axis=0)
+        self.count = valid.sum(axis=0)
+        self.head = dollar_volume[:2].copy()
+        self.steps = 0
+
+    def roll(self, close_price, volume):
+        dropped = self.head[0]
+        added = close_price[-1]*volume[-1]
+        dropped_valid = np.isfinite(dropped)
+        added_valid = np.isfinite(added)
+        
+        self.total += np.where(added_valid, added, 0) - \
+            np.where(dropped_valid, dropped, 0)
+        self.count += added_valid.astype(int) - dropped_valid
+        self.head[0] = self.head[1]
+        self.head[1] = close_price[1]*volume[1]
+        self.steps += 1
+
+    def update(self, today, assets, close_price, volume):
+        """ returns the average dollar volume for the current window. """
+        if self._can_roll(today, assets, close_price, volume):
+            self.roll(close_price, volume)
+        else:
+            self.reset(today, assets, close_price, volume)
+        
+        self.today = today
+        self.assets = np.array(assets, copy=True)
+        self.tail = close_price[-1]*volume[-1]
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 0, self.total/self.count, np.nan)
+
+############################ batched indicator kernels ###########################
+# A batched kernel takes the full (window x assets) price array and the 
+# indicator lookback, and returns one value per asset, matching the last 
+# value of the per-asset indicator function. Kernels are looked up by the 
+# indicator function object only, never by its name, so that a different 
+# function that happens to share a name is not silently substituted.
+
+_BATCH_KERNELS = {}
+
+def register_batch_kernel(indicator, kernel):
+    """
+       Register a batched kernel for an indicator function, to be used 
+       by `technical_factor` in place of applying the indicator one 
+       asset at a time. The library indicators have their kernels 
+       registered already, this is for other indicators.
+       
+       Args:
+           `indicator (callable)`: indicator function.
+           `kernel (callable)`: function of the form f(px, n), where px 
+           is a 2-D ndarray (window x assets).
+           
+       Returns:
+           None.
+           
+       .. code-block:: python
+           
+           # in the strategy code, before building the pipeline
+           def batch_range(px, lookback):
+               return px[-lookback:].max(axis=0) - px[-lookback:].min(axis=0)
+           
+           register_batch_kernel(price_range, batch_range)
+    """
+    if not callable(indicator):
+        raise ValueError(f'indicator must be a callable, got {type(indicator)}.')
+    if not callable(kernel):
+        raise ValueError(f'kernel must be a callable, got {type(kernel)}.')
+    _BATCH_KERNELS[indicator] = kernel
+    
+def get_batch_kernel(indicator_fn):
+    """ returns the batched kernel registered for the function, or None. """
+    try:
+        return _BATCH_KERNELS.get(indicator_fn)
+    except TypeError:
+        # unhashable callable
+        return
+
+def _validate_kernel(kernel, indicator_fn, px, lookback, n=8):
+    """
+        check the kernel against the indicator on the first few 
+        (complete) columns and drop it (with a warning) if they disagree.
+    """
+    px = px[:,:n]
+    try:
+        expected = np.apply_along_axis(indicator_fn, 0, px, lookback)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            computed = kernel(px, lookback)
+        matched = np.allclose(computed, expected, rtol=1e-6, atol=1e-8, 
+                              equal_nan=True)
+    except Exception:
+        matched = False
+        
+    if not matched:
+        name = getattr(indicator_fn, '__name__', indicator_fn)
+        msg = f'batched kernel does not match indicator {name}, '
+        msg += 'falling back to per-asset computation.'
+        warnings.warn(msg)
+        return
+    
+    return kernel
+
+_WEIGHTS_CACHE = {}
+
+def _smoothing_weights(length, n, alpha):
+    """
+        weights w such that w @ x gives the exponential smoothing of x 
+        (smoothing factor `alpha`), seeded with the simple average of 
+        the first `n` values, as done in TA-Lib.
+    """
+    key = (length, n, alpha)
+    if key not in _WEIGHTS_CACHE:
+        decay = (1 - alpha)**np.arange(length - n, -1, -1)
+        weights = np.empty(length)
+        weights[:n] = decay[0]/n
+        weights[n:] = alpha*decay[1:]
+        _WEIGHTS_CACHE[key] = weights
+    return _WEIGHTS_CACHE[key]
+
+def batch_sma(px, lookback):
+    """ last value of the simple moving average for each column. """
+    if len(px) < lookback:
+        return np.full(px.shape[1], np.nan)
+    return px[-lookback:].mean(axis=0)
+
+def batch_ema(px, lookback):
+    """ last value of the exponential moving average for each column. """
+    if len(px) < lookback:
+        return np.full(px.shape[1], np.nan)
+    weights = _smoothing_weights(len(px), lookback, 2.0/(lookback+1))
+    return weights @ px
+
+def batch_rsi(px, lookback=14):
+    """ last value of the (Wilder) relative strength index for each column. """
+    if len(px) < lookback + 1:
+        return np.full(px.shape[1], np.nan)
+    changes = np.diff(px, axis=0)
+    weights = _smoothing_weights(len(changes), lookback, 1.0/lookback)
+    gains = weights @ np.maximum(changes, 0)
+    # max(-x,0) = max(x,0) - x
+    losses = gains - weights @ changes
+    total = gains + losses
+    with np.errstate(divide='ignore', invalid='ignore'):
+        signal = np.where(total > 0, 100*gains/total, 0)
+    return signal
+
+def batch_roc(px, lookback):
+    """ last value of the rate of change (percent) for each column. """
+    if len(px) < lookback + 1:
+        return np.full(px.shape[1], np.nan)
+    prev = px[-(1+lookback)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        signal = np.where(prev != 0, 100*(px[-1]/prev - 1), 0)
+    return signal
+
+def batch_volatility(px, lookback=1):
+    """ 
+        standard deviation of the (overlapping) `lookback`-bar simple 
+        returns over the window, for each column.
+    """
+    lookback = 1 if lookback is None else lookback
+    if len(px) < lookback + 1:
+        return np.full(px.shape[1], np.nan)
+    returns = px[lookback:]/px[:-lookback] - 1
+    return np.std(returns, axis=0)
+
+def batch_skew(px, lookback=None):
+    """ (biased) sample skewness for each column. """
+    demeaned = px - px.mean(axis=0)
+    squared = demeaned*demeaned
+    m2 = squared.mean(axis=0)
+    m3 = (squared*demeaned).mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        signal = m3/m2**1.5
+    return signal
+
+# the kernels can be passed as indicators as well
+for _kernel in (batch_sma, batch_ema, batch_rsi, batch_roc, batch_volatility, 
+                batch_skew):
+    register_batch_kernel(_kernel, _kernel)
+
+############################ multi-lookback kernels ##############################
+# A multi-lookback kernel takes the (window x assets) price array and a 
+# tuple of lookbacks, and returns a (lookbacks x assets) array, computing 
+# all lookbacks together. Kernels are looked up by the indicator function 
+# object only, as the batched kernels.
+
+_MULTI_KERNELS = {}
+
+def register_multi_kernel(indicator, kernel):
+    """
+       Register a multi-lookback kernel for an indicator function, to 
+       be used by `multi_lookback_factor`.
+       
+       Args:
+           `indicator (callable)`: indicator function.
+           `kernel (callable)`: function of the form f(px, lookbacks), 
+           where px is a 2-D ndarray (window x assets).
+           
+       Returns:
+           None.
+    """
+    if not callable(indicator):
+        raise ValueError(f'indicator must be a callable, got {type(indicator)}.')
+    if not callable(kernel):
+        raise ValueError(f'kernel must be a callable, got {type(kernel)}.')
+    _MULTI_KERNELS[indicator] = kernel
+
+def get_multi_kernel(indicator_fn):
+    """ 
+        returns the registered multi-lookback kernel, else one built 
+        from the batched kernel, or None.
+    """
+    try:
+        kernel = _MULTI_KERNELS.get(indicator_fn)
+    except TypeError:
+        # unhashable callable
+        kernel = None
+    if kernel is not None:
+        return kernel
+    
+    batch_kernel = get_batch_kernel(indicator_fn)
+    if batch_kernel is None:
+        return
+    
+    def kernel(px, lookbacks):
+        return np.stack([batch_kernel(px, n) for n in lookbacks])
+    return kernel
+
+def _stacked_weights(length, lookbacks, alpha_fn):
+    """ smoothing weights for each lookback, NaN if too short. """
+    lookbacks = tuple(lookbacks)
+    key = (length, lookbacks, alpha_fn.__name__)
+    if key not in _WEIGHTS_CACHE:
+        weights = np.full((len(lookbacks), length), np.nan)
+        for i, n in enumerate(lookbacks):
+            if n <= length:
+                weights[i] = _smoothing_weights(length, n, alpha_fn(n))
+        _WEIGHTS_CACHE[key] = weights
+    return _WEIGHTS_CACHE[key]
+
+def _ema_alpha(n):
+    return 2.0/(n+1)
+
+def _wilder_alpha(n):
+    return 1.0/n
+
+def multi_sma(px, lookbacks):
+    """ simple moving averages for all lookbacks, from prefix sums. """
+    lookbacks = np.asarray(lookbacks)
+    totals = np.zeros((len(px)+1, px.shape[1]))
+    np.cumsum(px[::-1], axis=0, out=totals[1:])
+    valid = lookbacks <= len(px)
+    values = np.full((len(lookbacks), px.shape[1]), np.nan)
+    values[valid] = totals[lookbacks[valid]]/lookbacks[valid][:,None]
+    return values
+
+def multi_ema(px, lookbacks):
+    """ exponential moving averages for all lookbacks. """
+    return _stacked_weights(len(px), lookbacks, _ema_alpha) @ px
+
+def multi_rsi(px, lookbacks):
+    """ relative strength index for all lookbacks. """
+    changes = np.diff(px, axis=0)
+    weights = _stacked_weights(len(changes), lookbacks, _wilder_alpha)
+    gains = weights @ np.maximum(changes, 0)
+    losses = gains - weights @ changes
+    total = gains + losses
+    with np.errstate(divide='ignore', invalid='ignore'):
+        signal = np.where(total > 0, 100*gains/total, 0)
+    return np.where(np.isnan(total), np.nan, signal)
+
+def multi_roc(px, lookbacks):
+    """ rate of change (percent) for all lookbacks. """
+    lookbacks = np.asarray(lookbacks)
+    valid = lookbacks < len(px)
+    values = np.full((len(lookbacks), px.shape[1]), np.nan)
+    prev = px[-(1+lookbacks[valid])]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values[valid] = np.where(prev != 0, 100*(px[-1]/prev - 1), 0)
+    return values
+
+# the kernels can be passed as indicators as well
+for _kernel, _multi_kernel in [(batch_sma, multi_sma), (batch_ema, multi_ema), 
+                               (batch_rsi, multi_rsi), (batch_roc, multi_roc)]:
+    register_multi_kernel(_kernel, _multi_kernel)
+
+############################ library indicators ##################################
+# the kernels of the indicators in the technicals library, matched by identity
+
+try:
+    from blueshift.library.technicals import indicators as _indicators
+except ImportError:
+    _indicators = None
+
+for _name, _kernel, _multi_kernel in [
+        ('sma', batch_sma, multi_sma), ('ema', batch_ema, multi_ema), 
+        ('rsi', batch_rsi, multi_rsi), ('roc', batch_roc, multi_roc), 
+        ('volatility', batch_volatility, None)]:
+    _indicator = getattr(_indicators, _name, None)
+    if not callable(_indicator):
+        continue
+    register_batch_kernel(_indicator, _kernel)
+    if _multi_kernel is not None:
+        register_multi_kernel(_indicator, _multi_kernel)
+
+############################ precomputed panels ##################################
+# Panel functions take (dates x assets) arrays and return a panel of the 
+# same shape, where each row is the value computed over the window ending 
+# on that row (NaN where the window is incomplete).
+
+_PANEL_BLOCK = 2**22
+
+def _naive_dates(dates):
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is not None:
+        dates = dates.tz_convert(None)
+    return dates.normalize().values
+
+def _rolling_sum(x, window):
+    """ rolling sum along the first axis, using cumulative sums. """
+    total = np.cumsum(x, axis=0)
+    out = np.full(x.shape, np.nan)
+    if len(x) < window:
+        return out
+    out[window-1] = total[window-1]
+    out[window:] = total[window:] - total[:-window]
+    return out
+
+def _shift(x, n):
+    """ shift down along the first axis by `n` rows, filling NaN. """
+    out = np.full(x.shape, np.nan)
+    if n < len(x):
+        out[n:] = x[:len(x)-n]
+    return out
+
+def panel_returns(close, lookback, offset=0):
+    """ period returns over the window, see `returns_factor`. """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _shift(close, offset)/_shift(close, lookback-1) - 1
+
+def panel_dollar_volume(close, volume, lookback):
+    """ average dollar volume, ignoring NaNs, see `average_volume_factor`. """
+    dollar_volume = close * volume
+    valid = np.isfinite(dollar_volume)
+    total = _rolling_sum(np.where(valid, dollar_volume, 0), lookback)
+    count = _rolling_sum(valid.astype(np.float64), lookback)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, total/count, np.nan)
+
+def panel_volatility(close, lookback):
+    """ standard deviation of daily returns over the window. """
+    returns = np.full(close.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = close[1:]/close[:-1] - 1
+    # demean for numerical stability of the sum of squares
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        returns = returns - np.nanmean(returns, axis=0)
+    n = lookback - 1
+    invalid = _rolling_sum((~np.isfinite(returns)).astype(np.float64), n)
+    returns = np.where(np.isfinite(returns), returns, 0)
+    mean = _rolling_sum(returns, n)/n
+    mean_square = _rolling_sum(returns*returns, n)/n
+    variance = np.maximum(mean_square - mean*mean, 0)
+    return np.where(invalid == 0, np.sqrt(variance), np.nan)
+
+def panel_roc(close, lookback):
+    """ rate of change (percent), see `batch_roc`. """
+    prev = _shift(close, lookback)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(prev != 0, 100*(close/prev - 1), 0)
+
+def panel_indicator(close, lookback, kernel, indicator_lookback):
+    """ 
+        apply a batched kernel on all the sliding windows at once, with 
+        the windows stacked as columns, for indicators without a 
+        dedicated panel function. The windows are stacked in blocks of 
+        about `_PANEL_BLOCK` values to bound the memory.
+    """
+    out = np.full(close.shape, np.nan)
+    if len(close) < lookback:
+        return out
+    # (windows x assets x lookback) view
+    windows = np.lib.stride_tricks.sliding_window_view(close, lookback, axis=0)
+    step = max(1, _PANEL_BLOCK//(lookback*max(close.shape[1], 1)))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for start in range(0, len(windows), step):
+            block = windows[start:start+step]
+            px = block.transpose(2, 0, 1).reshape(lookback, -1)
+            rows = slice(lookback-1+start, lookback-1+start+len(block))
+            out[rows] = kernel(px, indicator_lookback).reshape(len(block), -1)
+    return out
+    windows = np.lib.stride_tricks.sliding_window_view(close, lookback, axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for i, window in enumerate(windows):
+            out[lookback-1+i] = kernel(window.T, indicator_lookback)
+    return out
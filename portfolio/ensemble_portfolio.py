@@ -10,7 +10,11 @@
 import talib as ta
 import pandas as pd
 import numpy as np
-import bisect
+import os
+import atexit
+import functools
+from abc import ABC, abstractmethod
+from collections import deque
 
 from blueshift.finance import commission, slippage
 from blueshift.api import(  symbol,
@@ -31,11 +35,10 @@ def expert_advisor_1(px, params):
     '''
         expert advisor based on Bollinger Band break-out
     '''
-    px = px.close.values
     upper, mid, lower = bollinger_band(px,params['BBands_period'])
     ind2 = ema(px, params['SMA_period_short'])
     ind3 = ema(px, params['SMA_period_long'])
-    last_px = px[-1]
+    last_px = px.close.values[-1]
     dist_to_upper = 100*(upper - last_px)/(upper - lower)
 
     if dist_to_upper > 95:
@@ -53,7 +56,6 @@ def expert_advisor_2(px, params):
     '''
         expert advisor based on moving average cross-over momentum
     '''
-    px = px.close.values
     ind2 = ema(px, params['SMA_period_short'])
     ind3 = ema(px, params['SMA_period_long'])
     
@@ -69,7 +71,7 @@ def expert_advisor_3(px, params):
         expert advisor based on candle stick patterns and Bollinger Bands
     '''
     ind1 = doji(px)
-    upper, mid, lower = bollinger_band(px.close.values,params['BBands_period'])
+    upper, mid, lower = bollinger_band(px,params['BBands_period'])
     last_px = px.close.values[-1]
     dist_to_upper = 100*(upper - last_px)/(upper - lower)
 
@@ -84,7 +86,7 @@ def expert_advisor_4(px, params):
     '''
         expert advisor based on Fibonacci support and resistance breakouts
     '''
-    lower, upper = fibonacci_support(px.close.values)
+    lower, upper = fibonacci_support(px)
     ind2 = adx(px, params['ADX_period'])
 
     if lower == -1:
@@ -133,7 +135,7 @@ def initialize(context):
     expert2 = Advisor('maxover_ea',expert_advisor_2, context.universe)
     expert3 = Advisor('rsi_ea',expert_advisor_3, context.universe)
     expert4 = Advisor('sup_res_ea',expert_advisor_4, context.universe)
-    context.agent = Agent([expert1, expert2, expert3, expert4])
+    context.agent = Agent([expert1, expert2, expert3, expert4], 'equal', lookback=20)
 
     # schedule agent weights updates
     schedule_function(update_agent_weights, date_rules.week_start(),
@@ -173,6 +175,13 @@ def rebalance(context,data):
 def analyze(context, perf):
     # let's see what our portfolio looks like at the end of the back-test run
     print(context.portfolio)
+    # and the latest performance of the advisors
+    print(context.agent.perfs.to_frame().tail())
+    # save the recorded signals, if any
+    if context.agent.recorder is not None:
+        context.agent.recorder.save()
+    # stop the advisor workers, if any
+    context.agent.close()
 
 def update_agent_weights(context, data):
     '''
@@ -192,20 +201,69 @@ def update_agent_perfs(context, data):
 class Agent():
     '''
         This is the class that implements strategy selection algorithm, including
-        constant re-balance, random-weight or no-regret algorithms
+        constant re-balance, random-weight or no-regret algorithms. The scheme is
+        either a name in `ALLOCATION_SCHEMES` (equal, fixed, kelly, sharpe or
+        no_regret) or a function with the same signature, and any extra keyword
+        arguments (e.g. `learning_rate` and `method` for no_regret, or
+        `fixed_weights` for fixed) are passed on to it. If a `recorder` (see
+        `SignalRecorder`) is given, the advisors' signals are recorded for `replay`.
+        If `workers` is given, the advisors are evaluated in as many worker
+        processes (see `AdvisorPool`), stopped by `close` (or on leaving a `with`
+        block of the agent). The scheme gets the full P&L history of the advisors
+        once there are `lookback` records, or only the latest `window` records if
+        `window` is given.
     '''
-    def __init__(self,advisors):
+    def __init__(self,advisors, scheme='equal', lookback=60, archive=False,
+                 recorder=None, workers=None, window=None, **params):
         try:
             self.advisors = advisors
             self.n_advisors = len(self.advisors)
         except:
             raise ValueError("advisors must be a list of Advisor objects")
-        
+
+        if not callable(scheme) and scheme not in ALLOCATION_SCHEMES:
+            msg = f'unknown allocation scheme {scheme}, '
+            msg = msg + f'expected one of {list(ALLOCATION_SCHEMES)}'
+            raise ValueError(msg)
+        self.scheme = ALLOCATION_SCHEMES.get(scheme, scheme)
+        self.params = params
+        self.lookback = lookback
+        self.window = window
         self.advisors_keys = [advisor.name for advisor in self.advisors]
-        self.perfs = pd.DataFrame()
-        self.weights = pd.DataFrame()
+        # advisors share the streaming indicators of each security
+        self.streams = {}
+        for advisor in self.advisors:
+            advisor.streams = self.streams
+        # the full P&L history is archived, unless only a window is used
+        self.perfs = History(self.advisors_keys, max(lookback, window or 0),
+                             archive or window is None)
+        self.weights = History(self.advisors_keys, self.lookback, archive)
+        # the advisors keep their weights and virtual P&L in a shared ledger
+        sizes = set(advisor.n_assets for advisor in self.advisors)
+        if len(sizes) > 1:
+            msg = f'advisors must trade the same universe, got sizes {sorted(sizes)}'
+            raise ValueError(msg)
+        self.ledger = Ledger(self.advisors_keys, sizes.pop() if sizes else 0)
+        for i, advisor in enumerate(self.advisors):
+            advisor.attach(self.ledger, i)
         self.current_weights = {}
         self.initial_weights()
+        self.recorder = recorder
+        if self.recorder is not None:
+            self.recorder.advisors = list(self.advisors_keys)
+        self.pool = AdvisorPool(self.advisors, workers) if workers else None
+
+    def close(self):
+        ''' stops the worker processes, if any. '''
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def compute_weights(self, context, data):
         '''
@@ -213,15 +271,24 @@ class Agent():
             update respective signals and combine them according to current weights 
             assigned to each experts
         '''
-        weights = dict((security,0.0) for security in context.universe)
         prices = data.history(context.universe, ['open','high','low','close'],
             context.params['indicator_lookback'],context.params['indicator_freq'])
-        for advisor in self.advisors:
-            w = self.current_weights[advisor.name]
-            advisor.compute_signals(context.universe, context.params, prices)
-            for security in context.universe:
-                weights[security] = weights[security] + advisor.current_weights[security]*w
-        context.weights = weights
+        prices = PriceArray(prices, context.universe)
+        signals = [None]*self.n_advisors
+        if self.pool is not None:
+            signals = self.pool.signals(context.universe, context.params, prices)
+        self.ledger.start(prices.close[:,-1])
+        for advisor, signal in zip(self.advisors, signals):
+            advisor.update_weights(context.universe, context.params, prices, signal)
+        self.ledger.update(prices.index[-1])
+        agent_weights = np.array([self.current_weights[key] for key in self.advisors_keys])
+        weights = agent_weights @ self.ledger.weights
+        context.weights = dict(zip(context.universe, weights))
+
+        if self.recorder is not None:
+            self.recorder.record_bar(
+                    prices.index[-1], context.universe, prices.close[:,-1],
+                    self.ledger.weights.copy(), self.ledger.perfs.copy())
 
     def update_weights(self):
         '''
@@ -230,142 +297,964 @@ class Agent():
         '''
         dt = get_datetime()
         self.current_weights = self.weighing_function()
-        weight = pd.DataFrame(self.current_weights, index=[dt])
-
-        if self.weights.empty:
-            self.weights = weight
-        else:
-            self.weights = self.weights.append(weight)
+        self.weights.append(dt, [self.current_weights[key] for key in self.advisors_keys])
+        if self.recorder is not None:
+            self.recorder.record_update(dt)
 
     def initial_weights(self):
         self.current_weights = dict((key,1/self.n_advisors) for key in self.advisors_keys)
 
     def weighing_function(self):
-        if len(self.perfs) < 20:
+        if len(self.perfs) < self.lookback:
             weights = dict((key,1.0/self.n_advisors) for key in self.advisors_keys)
             return weights
-        
-        #weights = dict((key,0.0) for key in self.advisors_keys)
-        weights = dict((key,1.0/self.n_advisors) for key in self.advisors_keys)
-        #weights = dict(zip(self.advisors_keys,[1 if i==3 else 0 for i in range(self.n_advisors)]))
 
-        return weights
+        last_weights = np.array([self.current_weights[key] for key in self.advisors_keys])
+        if self.window:
+            perfs = self.perfs.window(self.window).T
+        else:
+            perfs = self.perfs.rows().T
+        weights = self.scheme(perfs, last_weights, **self.params)
+        if weights is None:
+            return self.current_weights
+
+        return dict(zip(self.advisors_keys, weights))
     
     def update_pnl_history(self):
         dt = get_datetime()
-        perfs = dict((key,0.0) for key in self.advisors_keys)
-        for advisor in self.advisors:
-            perfs[advisor.name] = advisor.perf
-        perfs = pd.DataFrame(perfs, index=[dt])
-        if self.perfs.empty:
-            self.perfs = perfs
+        perfs = self.ledger.perfs.copy()
+        self.perfs.append(dt, perfs)
+        if self.recorder is not None:
+            self.recorder.record_pnl(dt, perfs)
+
+class History():
+    '''
+        Fixed-capacity history of a set of columns (e.g. advisors) indexed by
+        timestamps, with O(1) append. Each row is written twice in a buffer of
+        twice the capacity, so that the latest `capacity` rows are always
+        available as a contiguous (zero-copy) view. If `archive` is True, all
+        rows are also kept in a growing array, for `to_frame`.
+    '''
+    def __init__(self, columns, capacity, archive=False):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.values = np.full((2*capacity, len(self.columns)), np.nan)
+        self.index = np.empty(2*capacity, dtype=object)
+        self.count = 0
+        self.archive = archive
+        self.archived_values = np.empty((capacity, len(self.columns)))
+        self.archived_index = np.empty(capacity, dtype=object)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, dt, row):
+        pos = self.count % self.capacity
+        self.values[pos] = self.values[pos+self.capacity] = row
+        self.index[pos] = self.index[pos+self.capacity] = dt
+
+        if self.archive:
+            if self.count == len(self.archived_values):
+                # double the archive, for amortized O(1) append
+                self.archived_values = np.concatenate(
+                        [self.archived_values, np.empty_like(self.archived_values)])
+                self.archived_index = np.concatenate(
+                        [self.archived_index, np.empty_like(self.archived_index)])
+            self.archived_values[self.count] = row
+            self.archived_index[self.count] = dt
+        self.count += 1
+
+    def _rows(self, n):
+        n = min(n or self.capacity, self.capacity, self.count)
+        end = self.count % self.capacity
+        if self.count >= self.capacity:
+            end = end + self.capacity
+        return slice(end-n, end)
+
+    def window(self, n=None):
+        ''' view of the latest n (up to capacity) rows, oldest first. '''
+        return self.values[self._rows(n)]
+
+    def dates(self, n=None):
+        return self.index[self._rows(n)]
+
+    def rows(self):
+        ''' all the rows if archived, else the latest ones, oldest first. '''
+        if self.archive:
+            return self.archived_values[:self.count]
+        return self.window()
+
+    def to_frame(self):
+        ''' all the rows if archived, else the latest ones, as a DataFrame. '''
+        if self.archive:
+            index = self.archived_index[:self.count]
         else:
-            self.perfs = self.perfs.append(perfs)
+            index = self.dates()
+        values = self.rows()
+        return pd.DataFrame(values, index=pd.Index(list(index)),
+                            columns=self.columns)
 
 class Advisor():
     '''
         This is the class that implements individual strategies with individual signal
-        functions. This class also maintains the updated pnl of the strategy
+        functions. This class also maintains the updated pnl of the strategy, in a row
+        of a `Ledger` - its own, or the one shared by the advisors of an `Agent`. The
+        signal function is called for each security with its price stream, or, if
+        `vectorized` is True, once with the `PriceArray` of the universe and must
+        return the signals of all securities as an array.
     '''
-    def __init__(self, name, signal_fn, universe):
+    def __init__(self, name, signal_fn, universe, vectorized=False):
         self.n_assets = len(universe)
+        self.universe = list(universe)
         self.name = name
         self.signal_fn = signal_fn
-        self.last_px = dict((security,0.0) for security in universe)
-        self.current_px = dict((security,0.0) for security in universe)
-        self.last_weights = dict((security,0.0) for security in universe)
-        self.current_weights = dict((security,0.0) for security in universe)
-        self.perf = 100.0
+        self.vectorized = vectorized
+        self.streams = {}
+        self.attach(Ledger([name], self.n_assets))
 
-    def get_price(self, prices, security):
-        try:
-            self.last_px[security] = self.current_px[security]
-            px = prices.loc[:,security].values
-            self.current_px[security] = px[-1]
-        except:
-            try:
-                self.last_px[security] = self.current_px[security]
-                px = prices.xs(security)
-                self.current_px[security] = px['close'].values[-1]
-            except:
-                raise ValueError('Unknown type of historical price data')
-        return(px)
-
-    def compute_signals(self, universe, params, prices):
+    def attach(self, ledger, row=0):
+        ''' keep the weights and virtual P&L of the advisor in a row of the ledger. '''
+        self.ledger = ledger
+        self.row = row
+
+    @property
+    def weights(self):
+        return self.ledger.weights[self.row]
+
+    @property
+    def last_weights(self):
+        return self.ledger.last_weights[self.row]
+
+    @property
+    def perf(self):
+        return self.ledger.perfs[self.row]
+
+    @property
+    def current_weights(self):
+        return dict(zip(self.universe, self.weights))
+
+    def get_stream(self, security, px):
+        if security not in self.streams:
+            self.streams[security] = PriceStream()
+        return self.streams[security].update(px)
+
+    def get_signals(self, universe, params, prices):
+        if self.vectorized:
+            return np.asarray(self.signal_fn(prices, params), dtype=np.float64)
+
+        signals = np.empty(len(universe))
+        for i, security in enumerate(universe):
+            px = self.get_stream(security, prices.frame(i))
+            signals[i] = self.signal_fn(px, params)
+        return signals
+
+    def compute_signals(self, universe, params, prices, signals=None):
+        '''
+            Computes the new weights and marks the ledger to market. This is for an
+            advisor on its own ledger, an `Agent` updates its shared ledger once
+            for all advisors.
+        '''
+        if not isinstance(prices, PriceArray):
+            prices = PriceArray(prices, universe)
+
+        self.ledger.start(prices.close[:,-1])
+        self.update_weights(universe, params, prices, signals)
+        self.ledger.update(prices.index[-1])
+
+    def update_weights(self, universe, params, prices, signals=None):
         num_secs = len(universe)
         weight = round(1.0/num_secs,2)*params['leverage']
-        for security in universe:
-            self.last_weights[security] = self.current_weights[security]
-            px = self.get_price(prices, security)
-            signal = self.signal_fn(px, params)
-            if signal == 999:
-                pass
-            elif signal > params['buy_signal_threshold']:
-                self.current_weights[security] = weight
-            elif signal < params['sell_signal_threshold']:
-                self.current_weights[security] = -weight
+
+        if signals is None:
+            signals = self.get_signals(universe, params, prices)
+        weights = np.where(signals > params['buy_signal_threshold'], weight,
+                           np.where(signals < params['sell_signal_threshold'],
+                                    -weight, 0.0))
+        self.ledger.weights[self.row] = np.where(signals == 999, self.last_weights, weights)
+
+class Ledger():
+    '''
+        Virtual P&L of a set of advisors trading the same universe. The weights are
+        kept as (advisors x assets) matrices and the prices as vectors of the assets,
+        and all the advisors are marked to market in a single vectorized step per
+        bar. The per-bar returns of the advisors are kept in a `History`, readable
+        as a zero-copy (bars x advisors) window with `returns.window(n)`.
+    '''
+    def __init__(self, advisors, n_assets, capacity=1024, archive=False):
+        self.advisors = list(advisors)
+        self.n_assets = n_assets
+        self.last_px = np.zeros(n_assets)
+        self.current_px = np.zeros(n_assets)
+        self.last_weights = np.zeros((len(self.advisors), n_assets))
+        self.weights = np.zeros((len(self.advisors), n_assets))
+        self.perfs = np.full(len(self.advisors), 100.0)
+        self.returns = History(self.advisors, capacity, archive)
+
+    def start(self, prices):
+        ''' starts a bar at the given (close) prices, before the weights update. '''
+        self.last_px, self.current_px = self.current_px, np.array(prices, dtype=np.float64)
+        self.last_weights[:] = self.weights
+
+    def update(self, dt=None):
+        ''' marks all advisors to market, with the weights of the last bar. '''
+        traded = self.last_px != 0
+        px_change = np.zeros(self.n_assets)
+        px_change[traded] = self.current_px[traded]/self.last_px[traded] - 1
+        growth = np.prod(1 + self.last_weights*px_change/self.n_assets, axis=1)
+        self.perfs *= growth
+        self.returns.append(dt, growth - 1)
+
+class PriceArray():
+    '''
+        Price history of the universe as a contiguous (assets x bars x fields)
+        array, converted once from the `data.history` output and shared by the
+        advisors. Each field is available as an (assets x bars) view, e.g.
+        `prices.close`, and `frame` returns the history of a single security.
+    '''
+    def __init__(self, prices, universe):
+        self.assets = list(universe)
+        n = len(self.assets)
+
+        if isinstance(prices.index, pd.MultiIndex):
+            # multiple fields, indexed by (asset, timestamp)
+            self.fields = list(prices.columns)
+            assets = prices.index.get_level_values(0)
+            bars = len(prices)//n
+            if bars*n == len(prices) and list(assets[::bars]) == self.assets:
+                self.index = prices.index.get_level_values(1)[:bars]
+                values = prices.values.reshape(n, bars, len(self.fields))
             else:
-                self.current_weights[security] = 0.0
-        self.update_performance()
+                self.index = prices.index.get_level_values(1).unique().sort_values()
+                values = np.stack([prices.xs(security).reindex(self.index).values \
+                                   for security in self.assets])
+        elif isinstance(prices, pd.DataFrame):
+            # single field, with assets as columns
+            self.fields = ['close']
+            self.index = prices.index
+            values = prices[self.assets].values.T[:,:,None]
+        else:
+            raise ValueError('Unknown type of historical price data')
+
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.frames = {}
+
+    @classmethod
+    def from_values(cls, values, index, assets, fields):
+        prices = cls.__new__(cls)
+        prices.values, prices.index = values, index
+        prices.assets, prices.fields = list(assets), list(fields)
+        prices.frames = {}
+        return prices
+
+    def __getattr__(self, name):
+        fields = self.__dict__.get('fields', ())
+        if name not in fields:
+            raise AttributeError(name)
+        return self.values[:,:,fields.index(name)]
+
+    def frame(self, i):
+        if i not in self.frames:
+            # a copy, so that the streams do not keep a view of the
+            # (possibly shared memory) price array
+            self.frames[i] = pd.DataFrame(
+                    self.values[i], index=self.index, columns=self.fields,
+                    copy=True)
+        return self.frames[i]
+
+############################ allocation schemes ##########################################
+# each scheme takes the (advisors x time) performance matrix and the current weights of
+# the advisors, and returns the new weights (or None to keep the current ones)
+
+def _growth(perfs):
+    growth = (perfs[:,-1]/perfs[:,0])**(1.0/perfs.shape[1]) - 1
+    returns = perfs[:,1:]/perfs[:,:-1] - 1
+    return growth, returns
+
+def equal_weights(perfs, last_weights, **kwargs):
+    n = len(perfs)
+    return np.full(n, 1.0/n)
+
+def fixed_weights(perfs, last_weights, fixed_weights=None, **kwargs):
+    if fixed_weights is None:
+        raise ValueError('fixed weights must be specified for the fixed scheme')
+    weights = np.asarray(fixed_weights, dtype=np.float64)
+    return weights/weights.sum()
+
+def kelly_weights(perfs, last_weights, **kwargs):
+    growth, returns = _growth(perfs)
+    kelly = np.round(np.maximum(growth/returns.var(axis=1, ddof=1), 0.0), 4)
+    total = kelly.sum()
+    if total < 1E-20:
+        return
+    return kelly/total
+
+def sharpe_weights(perfs, last_weights, **kwargs):
+    growth, returns = _growth(perfs)
+    sharpe = np.round(np.maximum(growth/returns.std(axis=1, ddof=1), 0.0), 4)
+    total = sharpe.sum()
+    if total < 1E-20:
+        return
+    return sharpe/total
+
+def no_regret_weights(perfs, last_weights, learning_rate=0.2, method=0, **kwargs):
+    if method == 0:
+        growth, returns = _growth(perfs)
+        perf = np.round(np.maximum(growth/returns.std(axis=1, ddof=1), 0.0), 4)
+    else:
+        perf = np.round(perfs[:,-1]/perfs[:,0], 4)
+
+    total = perf @ last_weights
+    if total < 1E-20:
+        return
+    # exponential weights, shifted by the max to avoid overflow
+    scores = learning_rate*perf/total
+    updates = np.exp(scores - scores.max())
+    return updates/updates.sum()
+
+ALLOCATION_SCHEMES = {
+        'equal':equal_weights,
+        'fixed':fixed_weights,
+        'kelly':kelly_weights,
+        'sharpe':sharpe_weights,
+        'no_regret':no_regret_weights,
+        }
+
+############################ signal recording and replay #################################
+
+class SignalRecorder():
+    '''
+        Records, in the order they happen, the advisors' weights, prices and virtual
+        P&L at each signal computation, as well as the agent's P&L snapshots and
+        weight updates. The tape is saved as a compressed npz file of arrays, and
+        `replay` re-applies any allocation scheme over it, without computing the
+        advisor signals again.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.advisors = []
+        self.assets = []
+        self.seq = 0
+        self.bars = {'seq':[], 'dt':[], 'prices':[], 'weights':[], 'perfs':[]}
+        self.pnls = {'seq':[], 'dt':[], 'perfs':[]}
+        self.updates = {'seq':[], 'dt':[]}
+
+    def _record(self, table, dt, **values):
+        self.seq = self.seq + 1
+        table['seq'].append(self.seq)
+        table['dt'].append(pd.Timestamp(dt).value)
+        for key, value in values.items():
+            table[key].append(value)
+
+    def record_bar(self, dt, assets, prices, weights, perfs):
+        if not self.assets:
+            self.assets = [str(getattr(asset, 'symbol', asset)) for asset in assets]
+        self._record(self.bars, dt, prices=prices, weights=weights, perfs=perfs)
+
+    def record_pnl(self, dt, perfs):
+        self._record(self.pnls, dt, perfs=perfs)
+
+    def record_update(self, dt):
+        self._record(self.updates, dt)
+
+    def save(self):
+        n_advisors, n_assets = len(self.advisors), len(self.assets)
+        tape = {'advisors':np.array(self.advisors), 'assets':np.array(self.assets)}
+        for name, table in [('bar',self.bars), ('pnl',self.pnls), ('update',self.updates)]:
+            tape[f'{name}_seq'] = np.array(table['seq'], dtype=np.int64)
+            tape[f'{name}_dt'] = np.array(table['dt'], dtype=np.int64)
+        tape['bar_prices'] = np.array(self.bars['prices']).reshape(-1, n_assets)
+        tape['bar_weights'] = np.array(self.bars['weights']).reshape(-1, n_advisors, n_assets)
+        tape['bar_perfs'] = np.array(self.bars['perfs']).reshape(-1, n_advisors)
+        tape['pnl_perfs'] = np.array(self.pnls['perfs']).reshape(-1, n_advisors)
+        np.savez_compressed(self.path, **tape)
+
+def replay(path, scheme='equal', lookback=60, window=None, **params):
+    '''
+        Replays a tape recorded by `SignalRecorder` with an allocation scheme (a name
+        in `ALLOCATION_SCHEMES` or a function), with extra keyword arguments passed on
+        to it as in `Agent`. Returns the agent weights at each update and the equity
+        curve of the combined portfolio. Portfolio returns are computed from the
+        recorded prices, assuming the combined target weights are reached at each
+        signal computation. As in `Agent`, the scheme gets the P&L history from the
+        start, or its latest `window` records if `window` is given.
+
+        .. code-block:: python
+
+            for rate in [0.1, 0.2, 0.35, 0.5]:
+                weights, equity = replay('tape.npz', 'no_regret', 60,
+                                         learning_rate=rate, method=1)
+                print(rate, equity.iloc[-1])
+    '''
+    tape = np.load(path)
+    scheme = ALLOCATION_SCHEMES.get(scheme, scheme)
+    advisors = list(tape['advisors'])
+    n = len(advisors)
+    pnl_perfs = tape['pnl_perfs']
+
+    # replay the weight updates, in order with the P&L snapshots
+    weights = np.full(n, 1.0/n)
+    updates = np.empty((len(tape['update_seq']), n))
+    snapshots = np.searchsorted(tape['pnl_seq'], tape['update_seq'])
+    for i, k in enumerate(snapshots):
+        if k < lookback:
+            weights = np.full(n, 1.0/n)
+        else:
+            start = max(k-window, 0) if window else 0
+            new_weights = scheme(pnl_perfs[start:k].T, weights, **params)
+            if new_weights is not None:
+                weights = np.asarray(new_weights, dtype=np.float64)
+        updates[i] = weights
 
-    def update_performance(self):
-        for key in self.last_weights:
-            if self.last_px[key] != 0:
-                px_change = self.current_px[key] / self.last_px[key] - 1
-                self.perf = self.perf*(1 + self.last_weights[key]*px_change/self.n_assets)
+    # agent weights in force at each bar, and the combined portfolio
+    in_force = np.vstack([np.full((1,n), 1.0/n), updates])
+    in_force = in_force[np.searchsorted(tape['update_seq'], tape['bar_seq'])]
+    targets = np.einsum('ba,bas->bs', in_force, tape['bar_weights'])
+    prices = tape['bar_prices']
+    returns = np.nansum(targets[:-1]*(prices[1:]/prices[:-1] - 1), axis=1)
+    equity = np.concatenate([[1.0], np.cumprod(1 + returns)])
+
+    weights = pd.DataFrame(updates, columns=advisors,
+                           index=pd.to_datetime(tape['update_dt'], utc=True))
+    equity = pd.Series(equity[:len(tape['bar_seq'])],
+                       index=pd.to_datetime(tape['bar_dt'], utc=True))
+    return weights, equity
+
+############################ parallel advisor evaluation #################################
+
+class AdvisorPool():
+    '''
+        Computes the signals of the advisors in worker processes. Each advisor is
+        assigned to a fixed worker, which keeps its price streams across bars, and
+        the price array is shared with the workers through shared memory once per
+        bar. Signals are gathered in the order of the advisors and are identical to
+        the ones computed serially.
+    '''
+    def __init__(self, advisors, workers=None):
+        import multiprocessing as mp
+        from multiprocessing import resource_tracker
+
+        method = 'fork' if 'fork' in mp.get_all_start_methods() else 'spawn'
+        context = mp.get_context(method)
+        # start the tracker first, so that the workers share it and do not
+        # clean up the shared memory on their own
+        resource_tracker.ensure_running()
+        self.n_advisors = len(advisors)
+        self.n_workers = max(1, min(workers or os.cpu_count() or 1, self.n_advisors))
+        self.shm = None
+        self.conns = []
+        self.procs = []
+
+        for k in range(self.n_workers):
+            assigned = dict((i, advisors[i]) for i in range(k, self.n_advisors, self.n_workers))
+            conn, child = context.Pipe()
+            proc = context.Process(target=_advisor_worker, args=(child, assigned),
+                                   daemon=True)
+            proc.start()
+            child.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+        atexit.register(self.close)
+
+    def share(self, values):
+        from multiprocessing import shared_memory
+
+        if self.shm is None or self.shm.size < values.nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        shared = np.ndarray(values.shape, dtype=np.float64, buffer=self.shm.buf)
+        shared[:] = values
+        return self.shm.name
+
+    def signals(self, universe, params, prices):
+        name = self.share(prices.values)
+        task = (name, prices.values.shape, prices.index, prices.fields,
+                list(universe), params)
+        for conn in self.conns:
+            conn.send(task)
+
+        signals = [None]*self.n_advisors
+        errors = []
+        for conn in self.conns:
+            results = conn.recv()
+            if isinstance(results, Exception):
+                errors.append(results)
+                continue
+            for i, values in results.items():
+                signals[i] = values
+        if errors:
+            raise errors[0]
+        return signals
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for proc in self.procs:
+            proc.join(timeout=5)
+        self.conns, self.procs = [], []
+        self.release()
+        atexit.unregister(self.close)
+
+def _advisor_worker(conn, advisors):
+    '''
+        Worker process loop, computes the signals of a fixed set of advisors on
+        the price array shared by the agent, until it receives None.
+    '''
+    from multiprocessing import shared_memory
+
+    streams = {}
+    for advisor in advisors.values():
+        advisor.streams = streams
+    shm = None
+
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+
+            name, shape, index, fields, universe, params = task
+            if shm is None or shm.name != name:
+                # the agent moved to a new (larger) segment
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=name)
+            values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            prices = PriceArray.from_values(values, index, universe, fields)
+            try:
+                results = dict((i, advisor.get_signals(universe, params, prices)) \
+                               for i, advisor in advisors.items())
+            except Exception as e:
+                results = e
+            conn.send(results)
+            del values, prices
+    finally:
+        if shm is not None:
+            shm.close()
 
 ############################ common technical indicators #################################
 
+def per_bar(fn):
+    '''
+        Cache the value of an indicator on the price stream of a security,
+        keyed by the indicator and its parameters. The stream clears the
+        cache when the bar advances, so that advisors sharing the stream
+        compute each indicator once per bar.
+    '''
+    @functools.wraps(fn)
+    def decorated(px, *args):
+        if not isinstance(px, PriceStream):
+            return fn(px, *args)
+        key = (fn.__name__, args)
+        if key not in px.cache:
+            px.cache[key] = fn(px, *args)
+        return px.cache[key]
+    return decorated
+
 def sma(px, lookback):
-    sig = ta.SMA(px, timeperiod=lookback)
-    return sig[-1]
+    if isinstance(px, PriceStream):
+        return px.indicator(StreamingSMA, lookback)
+    return sma_tail(px, lookback)
 
 def ema(px, lookback):
-    sig = ta.EMA(px, timeperiod=lookback)
-    return sig[-1]
+    if isinstance(px, PriceStream):
+        return px.indicator(StreamingEMA, lookback)
+    return ema_tail(px, lookback)
 
 def rsi(px, lookback):
-    sig = ta.RSI(px, timeperiod=lookback)
-    return sig[-1]
+    if isinstance(px, PriceStream):
+        return px.indicator(StreamingRSI, lookback)
+    return rsi_tail(px, lookback)
 
 def bollinger_band(px, lookback):
-    upper, mid, lower = ta.BBANDS(px, timeperiod=lookback)
-    return upper[-1], mid[-1], lower[-1]
+    if isinstance(px, PriceStream):
+        return px.indicator(StreamingBBands, lookback)
+    return bbands_tail(px, lookback)
 
+@per_bar
 def macd(px, lookback):
-    macd_val, macdsignal, macdhist = ta.MACD(px)
-    return macd_val[-1], macdsignal[-1], macdhist[-1]
+    if isinstance(px, PriceStream):
+        px = px.close.values
+    return macd_tail(px)
 
+@per_bar
 def doji(px):
     sig = ta.CDLDOJI(px.open.values, px.high.values, px.low.values, px.close.values)
     return sig[-1]
 
+@per_bar
 def adx(px, lookback):
-    signal = ta.ADX(px.high.values, px.low.values, px.close.values, timeperiod=lookback)
-    return signal[-1]
+    # over the fetched window (not streamed), the ADX of a long lookback
+    # depends on where its smoothing starts
+    return adx_tail(px.high, px.low, px.close, lookback)
 
+@per_bar
 def fibonacci_support(px):
-    def fibonacci_levels(px):
-        return [min(px) + l*(max(px) - min(px)) for l in [0,0.236,0.382,0.5,0.618,1]]
-
-    def find_interval(x, val):
-        return (-1 if val < x[0] else 99) if val < x[0] or val > x[-1] \
-            else  max(bisect.bisect_left(x,val)-1,0)
-
-    last_price = px[-1]
-    lower_dist = upper_dist = 0
-    sups = fibonacci_levels(px[:-1])
-    idx = find_interval(sups, last_price)
-
-    if idx==-1:
-        lower_dist = -1
-        upper_dist = round(100.0*(sups[0]/last_price-1),2)
-    elif idx==99:
-        lower_dist = round(100.0*(last_price/sups[-1]-1),2)
-        upper_dist = -1
-    else:
-        lower_dist = round(100.0*(last_price/sups[idx]-1),2)
-        upper_dist = round(100.0*(sups[idx+1]/last_price-1),2)
+    '''
+        Distances (in percent) of the last price to the Fibonacci levels just
+        below and above it, with the levels from the earlier prices. It is -1
+        for the lower (upper) distance if the price is below (above) all levels.
+        For a (assets x bars) array, the distances of all assets are returned
+        as arrays.
+    '''
+    if isinstance(px, PriceStream):
+        levels = px.indicator(StreamingFibonacci, len(px.close)-1)
+        return fibonacci_distances(levels, px.close.values[-1])
+
+    px = np.asarray(px, dtype=np.float64)
+    return fibonacci_distances(fibonacci_levels(px[..., :-1]), px[..., -1])
+
+FIBONACCI_RATIOS = np.array([0,0.236,0.382,0.5,0.618,1])
+
+def fibonacci_levels(px, low=None, high=None):
+    ''' Fibonacci levels of the price range along the last axis, or of the
+        given low and high, as a (..., 6) array. '''
+    if low is None:
+        low, high = np.min(px, axis=-1), np.max(px, axis=-1)
+    low, high = np.asarray(low), np.asarray(high)
+    return low[..., None] + FIBONACCI_RATIOS*(high - low)[..., None]
+
+def fibonacci_distances(levels, last_price):
+    # locate the last prices in the (sorted) levels of each asset, as a
+    # row-wise searchsorted (bisect_left)
+    last_price = np.asarray(last_price, dtype=np.float64)
+    idx = (levels < last_price[..., None]).sum(axis=-1)
+    below = last_price < levels[..., 0]
+    above = last_price > levels[..., -1]
+    idx = np.clip(idx-1, 0, 4)
+    lower_idx = np.where(above, 5, idx)
+    upper_idx = np.where(below, 0, idx+1)
+    lower = np.take_along_axis(levels, lower_idx[..., None], axis=-1)[..., 0]
+    upper = np.take_along_axis(levels, upper_idx[..., None], axis=-1)[..., 0]
+
+    lower_dist = np.where(below, -1, np.round(100.0*(last_price/lower-1),2))
+    upper_dist = np.where(above, -1, np.round(100.0*(upper/last_price-1),2))
+    return lower_dist[()], upper_dist[()]
+
+############################ tail indicator kernels ######################################
+
+# the tail kernels return only the latest value of an indicator, from the last bars it
+# depends on. The time is the last axis, so that a (assets x bars) array gives the
+# values of all assets at once. Recursive (exponentially smoothed) indicators are
+# truncated to the bars with a weight above TAIL_TOLERANCE, the error of the smoothed
+# values is then at most TAIL_TOLERANCE times the range of the input.
+TAIL_TOLERANCE = 1e-10
+
+@functools.lru_cache(maxsize=64)
+def _tail_steps(decay, tol=TAIL_TOLERANCE):
+    ''' number of smoothing steps after which the seed weighs less than tol. '''
+    return int(np.ceil(np.log(tol)/np.log(decay))) if decay > 0 else 0
+
+@functools.lru_cache(maxsize=64)
+def _decay_weights(decay, steps):
+    ''' weights of the last `steps` inputs of a smoothing with the given decay. '''
+    weights = decay**np.arange(steps-1, -1, -1)
+    weights.setflags(write=False)
+    return weights
+
+def _smooth_tail(x, lookback, alpha, tol=TAIL_TOLERANCE):
+    # exponential smoothing seeded with the average of the first lookback values,
+    # as in TA-Lib, evaluated as a dot product over the truncated tail
+    decay = 1 - alpha
+    steps = min(x.shape[-1] - lookback, _tail_steps(decay, tol))
+    x = x[..., x.shape[-1]-lookback-steps:]
+    seed = x[..., :lookback].sum(axis=-1)/lookback
+    return seed*decay**steps + alpha*(x[..., lookback:] @ _decay_weights(decay, steps))
+
+def _nan(x):
+    value = np.full(x.shape[:-1], np.nan)
+    return value if value.ndim else float(value)
+
+def _by_rows(fn, *arrays):
+    # apply a 1-D (TA-Lib) kernel to each row of (assets x bars) arrays
+    if arrays[0].ndim == 1:
+        return fn(*arrays)
+    values = [fn(*rows) for rows in zip(*arrays)]
+    if values and isinstance(values[0], tuple):
+        return tuple(np.array(v) for v in zip(*values))
+    return np.array(values)
 
-    return lower_dist,upper_dist
+def sma_tail(x, lookback):
+    x = np.asarray(x, dtype=np.float64)
+    if x.shape[-1] < lookback:
+        return _nan(x)
+    return x[..., -lookback:].sum(axis=-1)/lookback
+
+def ema_tail(x, lookback, tol=TAIL_TOLERANCE):
+    x = np.asarray(x, dtype=np.float64)
+    if x.shape[-1] < lookback:
+        return _nan(x)
+    return _smooth_tail(x, lookback, 2.0/(lookback+1), tol)
+
+def rsi_tail(x, lookback, tol=TAIL_TOLERANCE):
+    x = np.asarray(x, dtype=np.float64)
+    if x.shape[-1] <= lookback:
+        return _nan(x)
+    steps = _tail_steps(1 - 1.0/lookback, tol)
+    change = np.diff(x[..., -(lookback+steps+1):], axis=-1)
+    gain = np.maximum(change, 0)
+    loss = gain - change
+    gain = _smooth_tail(gain, lookback, 1.0/lookback, tol)
+    loss = _smooth_tail(loss, lookback, 1.0/lookback, tol)
+    total = gain + loss
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, 100*gain/total, 0.0)[()]
+
+def bbands_tail(x, lookback, nbdev=2):
+    x = np.asarray(x, dtype=np.float64)
+    if x.shape[-1] < lookback:
+        return _nan(x), _nan(x), _nan(x)
+    x = x[..., -lookback:]
+    mid = x.sum(axis=-1)/lookback
+    var = (x*x).sum(axis=-1)/lookback - mid*mid
+    dev = nbdev*np.sqrt(np.maximum(var, 0))
+    return mid + dev, mid, mid - dev
+
+def macd_tail(x, fast=12, slow=26, signal=9, tol=TAIL_TOLERANCE):
+    x = np.asarray(x, dtype=np.float64)
+    bars = slow + signal + _tail_steps(1 - 2.0/(slow+1), tol) + _tail_steps(1 - 2.0/(signal+1), tol)
+    def kernel(x):
+        macd_val, macdsignal, macdhist = ta.MACD(x, fast, slow, signal)
+        return macd_val[-1], macdsignal[-1], macdhist[-1]
+    return _by_rows(kernel, x[..., -bars:])
+
+def adx_tail(high, low, close, lookback, tol=TAIL_TOLERANCE):
+    high, low, close = (np.asarray(v, dtype=np.float64) for v in (high, low, close))
+    bars = 2*lookback + 2*_tail_steps(1 - 1.0/lookback, tol)
+    def kernel(high, low, close):
+        return ta.ADX(high, low, close, timeperiod=lookback)[-1]
+    return _by_rows(kernel, high[..., -bars:], low[..., -bars:], close[..., -bars:])
+
+############################ streaming technical indicators ##############################
+
+class StreamingIndicator(ABC):
+    '''
+        Base class for indicators updated one bar at a time in O(1). The
+        values match the corresponding TA-Lib function run on all the bars
+        seen so far (NaN until enough bars are seen).
+    '''
+    fields = ('close',)
+
+    def seed(self, *series):
+        for values in zip(*series):
+            self.update(*values)
+        return self.value
+
+    @abstractmethod
+    def update(self, *values):
+        ''' adds the values (of `fields`) of the next bar. '''
+
+class StreamingSMA(StreamingIndicator):
+    def __init__(self, lookback):
+        self.lookback = lookback
+        self.window = deque(maxlen=lookback)
+        self.total = 0.0
+        self.count = 0
+        self.value = np.nan
+
+    def update(self, x):
+        if len(self.window) == self.lookback:
+            self.total -= self.window[0]
+        self.window.append(x)
+        self.total += x
+        self.count += 1
+        if self.count % self.lookback == 0:
+            # re-sum the window to stop rounding errors from accumulating
+            self.total = sum(self.window)
+        if len(self.window) == self.lookback:
+            self.value = self.total/self.lookback
+        return self.value
+
+class StreamingEMA(StreamingIndicator):
+    def __init__(self, lookback):
+        self.lookback = lookback
+        self.alpha = 2.0/(lookback+1)
+        self.total = 0.0
+        self.count = 0
+        self.value = np.nan
+
+    def update(self, x):
+        self.count += 1
+        if self.count < self.lookback:
+            self.total += x
+        elif self.count == self.lookback:
+            # seeded with the simple average, as TA-Lib
+            self.value = (self.total + x)/self.lookback
+        else:
+            self.value = (x - self.value)*self.alpha + self.value
+        return self.value
+
+class StreamingBBands(StreamingIndicator):
+    def __init__(self, lookback, nbdevup=2, nbdevdn=2):
+        self.lookback = lookback
+        self.nbdevup = nbdevup
+        self.nbdevdn = nbdevdn
+        self.window = deque(maxlen=lookback)
+        self.total = self.total_sq = 0.0
+        self.count = 0
+        self.value = (np.nan, np.nan, np.nan)
+
+    def update(self, x):
+        if len(self.window) == self.lookback:
+            old = self.window[0]
+            self.total -= old
+            self.total_sq -= old*old
+        self.window.append(x)
+        self.total += x
+        self.total_sq += x*x
+        self.count += 1
+        if self.count % self.lookback == 0:
+            self.total = sum(self.window)
+            self.total_sq = sum(v*v for v in self.window)
+        if len(self.window) == self.lookback:
+            mean = self.total/self.lookback
+            variance = self.total_sq/self.lookback - mean*mean
+            std = np.sqrt(variance) if variance > 0 else 0.0
+            self.value = (mean + self.nbdevup*std, mean, mean - self.nbdevdn*std)
+        return self.value
+
+class StreamingRSI(StreamingIndicator):
+    def __init__(self, lookback):
+        self.lookback = lookback
+        self.last = None
+        self.gain = self.loss = 0.0
+        self.count = 0
+        self.value = np.nan
+
+    def update(self, x):
+        if self.last is None:
+            self.last = x
+            return self.value
+        change, self.last = x - self.last, x
+        gain, loss = (change, 0.0) if change > 0 else (0.0, -change)
+        self.count += 1
+        n = self.lookback
+        if self.count < n:
+            self.gain += gain
+            self.loss += loss
+            return self.value
+        if self.count == n:
+            self.gain = (self.gain + gain)/n
+            self.loss = (self.loss + loss)/n
+        else:
+            self.gain = (self.gain*(n-1) + gain)/n
+            self.loss = (self.loss*(n-1) + loss)/n
+        total = self.gain + self.loss
+        self.value = 100*self.gain/total if total != 0 else 0.0
+        return self.value
+
+class StreamingRange(StreamingIndicator):
+    '''
+        Rolling minimum and maximum of the last `lookback` values, with a
+        monotonic deque of (position, value) for each, so that every value
+        is added and removed at most once.
+    '''
+    def __init__(self, lookback):
+        self.lookback = lookback
+        self.lows = deque()
+        self.highs = deque()
+        self.count = 0
+        self.value = (np.nan, np.nan)
+
+    def update(self, x):
+        while self.lows and self.lows[-1][1] >= x:
+            self.lows.pop()
+        self.lows.append((self.count, x))
+        while self.highs and self.highs[-1][1] <= x:
+            self.highs.pop()
+        self.highs.append((self.count, x))
+
+        self.count += 1
+        expired = self.count - self.lookback
+        if self.lows[0][0] < expired:
+            self.lows.popleft()
+        if self.highs[0][0] < expired:
+            self.highs.popleft()
+        if self.count >= self.lookback:
+            self.value = (self.lows[0][1], self.highs[0][1])
+        return self.value
+
+class StreamingFibonacci(StreamingIndicator):
+    '''
+        Fibonacci levels of the range of the `lookback` values before the
+        latest one, as in `fibonacci_support`.
+    '''
+    def __init__(self, lookback):
+        self.range = StreamingRange(lookback)
+        self.last = None
+
+    @property
+    def value(self):
+        return fibonacci_levels(None, *self.range.value)
+
+    def update(self, x):
+        if self.last is not None:
+            self.range.update(self.last)
+        self.last = x
+
+class PriceStream():
+    '''
+        Streaming indicators for a security. It is updated with the latest
+        price history and feeds only the bars added since the last update
+        to its indicators. Indicators are seeded from the history when
+        first requested, and re-seeded if the new history does not overlap
+        the last one. Bars with missing values are skipped. Values of
+        other indicators are cached in `cache` until the bar advances.
+    '''
+    def __init__(self):
+        self.frame = None
+        self.last_dt = None
+        self.indicators = {}
+        self.cache = {}
+
+    def __getattr__(self, name):
+        # price fields (e.g. `close`) from the latest history
+        frame = self.__dict__.get('frame')
+        if frame is None:
+            raise AttributeError(name)
+        return getattr(frame, name)
+
+    def update(self, frame):
+        if not hasattr(frame, 'index'):
+            return frame
+
+        dt = frame.index[-1]
+        if dt == self.last_dt:
+            self.frame = frame
+            return self
+
+        idx = frame.index.searchsorted(self.last_dt) \
+            if self.last_dt is not None else len(frame)
+        if idx < len(frame) and frame.index[idx] == self.last_dt:
+            new = frame.iloc[idx+1:]
+            for indicator in self.indicators.values():
+                self.feed(indicator, new)
+        else:
+            self.indicators = {}
+
+        self.frame, self.last_dt = frame, dt
+        self.cache = {}
+        return self
+
+    def feed(self, indicator, frame):
+        if frame.ndim == 1:
+            series = [frame.values]
+        else:
+            series = [frame[field].values for field in indicator.fields]
+        valid = ~np.isnan(series).any(axis=0)
+        indicator.seed(*[values[valid] for values in series])
 
+    def indicator(self, cls, *args):
+        key = (cls, args)
+        if key not in self.indicators:
+            self.indicators[key] = cls(*args)
+            self.feed(self.indicators[key], self.frame)
+        return self.indicators[key].value
@@ -126,54 +126,159 @@ def analyze(context, perf):
 class Advisor():
     '''
         This is the class that implements individual strategies with individual signal
-        functions. This class also maintains the updated pnl of the strategy
+        functions. This class also maintains the updated pnl of the strategy, in a row
+        of a `Ledger` - its own, or the one shared by the advisors of an `Agent`. The
+        signal function is called for each security with its price history, or, if
+        `vectorized` is True, once with the `PriceArray` of the universe and must
+        return the signals of all securities as an array.
     '''
-    def __init__(self, name, signal_fn, universe):
+    def __init__(self, name, signal_fn, universe, vectorized=False):
         self.n_assets = len(universe)
+        self.universe = list(universe)
         self.name = name
         self.signal_fn = signal_fn
-        self.last_px = dict((security,0.0) for security in universe)
-        self.current_px = dict((security,0.0) for security in universe)
-        self.last_weights = dict((security,0.0) for security in universe)
-        self.current_weights = dict((security,0.0) for security in universe)
-        self.perf = 100.0
-
-    def get_price(self, prices, security):
-        try:
-            self.last_px[security] = self.current_px[security]
-            px = prices.loc[:,security].values
-            self.current_px[security] = px[-1]
-        except:
-            try:
-                self.last_px[security] = self.current_px[security]
-                px = prices.xs(security)
-                self.current_px[security] = px['close'].values[-1]
-            except:
-                raise ValueError('Unknown type of historical price data')
-        return(px)
-
-    def compute_signals(self, universe, params, prices):
+        self.vectorized = vectorized
+        self.attach(Ledger([name], self.n_assets))
+
+    def attach(self, ledger, row=0):
+        ''' keep the weights and virtual P&L of the advisor in a row of the ledger. '''
+        self.ledger = ledger
+        self.row = row
+
+    @property
+    def weights(self):
+        return self.ledger.weights[self.row]
+
+    @property
+    def last_weights(self):
+        return self.ledger.last_weights[self.row]
+
+    @property
+    def perf(self):
+        return self.ledger.perfs[self.row]
+
+    @property
+    def current_weights(self):
+        return dict(zip(self.universe, self.weights))
+
+    def get_signals(self, universe, params, prices):
+        if self.vectorized:
+            return np.asarray(self.signal_fn(prices, params), dtype=np.float64)
+
+        signals = np.empty(len(universe))
+        for i, security in enumerate(universe):
+            px = prices.frame(i)
+            signals[i] = self.signal_fn(px, params)
+        return signals
+
+    def compute_signals(self, universe, params, prices, signals=None):
+        '''
+            Computes the new weights and marks the ledger to market. This is for an
+            advisor on its own ledger, an `Agent` updates its shared ledger once
+            for all advisors.
+        '''
+        if not isinstance(prices, PriceArray):
+            prices = PriceArray(prices, universe)
+
+        self.ledger.start(prices.close[:,-1])
+        self.update_weights(universe, params, prices, signals)
+        self.ledger.update()
+
+    def update_weights(self, universe, params, prices, signals=None):
         num_secs = len(universe)
         weight = round(1.0/num_secs,2)*params['leverage']
-        for security in universe:
-            self.last_weights[security] = self.current_weights[security]
-            px = self.get_price(prices, security)
-            signal = self.signal_fn(px, params)
-            if signal == 999:
-                pass
-            elif signal > params['buy_signal_threshold']:
-                self.current_weights[security] = weight
-            elif signal < params['sell_signal_threshold']:
-                self.current_weights[security] = -weight
-            else:
-                self.current_weights[security] = 0.0
-        self.update_performance()
 
-    def update_performance(self):
-        for key in self.last_weights:
-            if self.last_px[key] != 0:
-                px_change = self.current_px[key] / self.last_px[key] - 1
-                self.perf = self.perf*(1 + self.last_weights[key]*px_change/self.n_assets)
+        if signals is None:
+            signals = self.get_signals(universe, params, prices)
+        weights = np.where(signals > params['buy_signal_threshold'], weight,
+                           np.where(signals < params['sell_signal_threshold'],
+                                    -weight, 0.0))
+        self.ledger.weights[self.row] = np.where(signals == 999, self.last_weights, weights)
+
+class Ledger():
+    '''
+        Virtual P&L of a set of advisors trading the same universe. The weights are
+        kept as (advisors x assets) matrices and the prices as vectors of the assets,
+        and all the advisors are marked to market in a single vectorized step per
+        bar.
+    '''
+    def __init__(self, advisors, n_assets):
+        self.advisors = list(advisors)
+        self.n_assets = n_assets
+        self.last_px = np.zeros(n_assets)
+        self.current_px = np.zeros(n_assets)
+        self.last_weights = np.zeros((len(self.advisors), n_assets))
+        self.weights = np.zeros((len(self.advisors), n_assets))
+        self.perfs = np.full(len(self.advisors), 100.0)
+
+    def start(self, prices):
+        ''' starts a bar at the given (close) prices, before the weights update. '''
+        self.last_px, self.current_px = self.current_px, np.array(prices, dtype=np.float64)
+        self.last_weights[:] = self.weights
+
+    def update(self):
+        ''' marks all advisors to market, with the weights of the last bar. '''
+        traded = self.last_px != 0
+        px_change = np.zeros(self.n_assets)
+        px_change[traded] = self.current_px[traded]/self.last_px[traded] - 1
+        growth = np.prod(1 + self.last_weights*px_change/self.n_assets, axis=1)
+        self.perfs *= growth
+
+class PriceArray():
+    '''
+        Price history of the universe as a contiguous (assets x bars x fields)
+        array, converted once from the `data.history` output and shared by the
+        advisors. Each field is available as an (assets x bars) view, e.g.
+        `prices.close`, and `frame` returns the history of a single security.
+    '''
+    def __init__(self, prices, universe):
+        self.assets = list(universe)
+        n = len(self.assets)
+
+        if isinstance(prices.index, pd.MultiIndex):
+            # multiple fields, indexed by (asset, timestamp)
+            self.fields = list(prices.columns)
+            assets = prices.index.get_level_values(0)
+            bars = len(prices)//n
+            if bars*n == len(prices) and list(assets[::bars]) == self.assets:
+                self.index = prices.index.get_level_values(1)[:bars]
+                values = prices.values.reshape(n, bars, len(self.fields))
+            else:
+                self.index = prices.index.get_level_values(1).unique().sort_values()
+                values = np.stack([prices.xs(security).reindex(self.index).values \
+                                   for security in self.assets])
+        elif isinstance(prices, pd.DataFrame):
+            # single field, with assets as columns
+            self.fields = ['close']
+            self.index = prices.index
+            values = prices[self.assets].values.T[:,:,None]
+        else:
+            raise ValueError('Unknown type of historical price data')
+
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.frames = {}
+
+    @classmethod
+    def from_values(cls, values, index, assets, fields):
+        prices = cls.__new__(cls)
+        prices.values, prices.index = values, index
+        prices.assets, prices.fields = list(assets), list(fields)
+        prices.frames = {}
+        return prices
+
+    def __getattr__(self, name):
+        fields = self.__dict__.get('fields', ())
+        if name not in fields:
+            raise AttributeError(name)
+        return self.values[:,:,fields.index(name)]
+
+    def frame(self, i):
+        if i not in self.frames:
+            # a copy, so that an advisor cannot write into the price array
+            self.frames[i] = pd.DataFrame(
+                    self.values[i], index=self.index, columns=self.fields,
+                    copy=True)
+        return self.frames[i]
 
 ############################ common technical indicators #################################
 
@@ -229,4 +334,3 @@ def fibonacci_support(px):
         upper_dist = round(100.0*(sups[idx+1]/last_price-1),2)
 
     return lower_dist,upper_dist
-